@@ -1,32 +1,58 @@
 from asyncio import sleep, TimeoutError
+from concurrent.futures import ThreadPoolExecutor
 import inspect
+import io
+import logging
 import random
 import re
+import tempfile
 import itertools as it
-from operator import itemgetter
-from typing import Union
+from typing import Mapping, Union
 
 import discord
 from mongoengine import connect
 from redbot.core import checks
 from redbot.core.bot import Red
 from redbot.core.commands import commands
-from redbot.core.utils.menus import menu, DEFAULT_CONTROLS, close_menu
-from redbot.core.utils.predicates import MessagePredicate
+from redbot.core.utils.chat_formatting import box, pagify
+from redbot.core.utils.menus import menu, DEFAULT_CONTROLS, start_adding_reactions
+from redbot.core.utils.predicates import MessagePredicate, ReactionPredicate
 
-from .data.character.attributes import Attributes
+from .data.character.attributes import Attributes, race_templates
 from .data.character.character import Character, CharacterNotFound
 from .data.character.inventory.equipment import (
     Equipment,
     ItemIsNotEquippable,
     ItemNotFoundInEquipment,
 )
-from .data.character.inventory.inventory import Inventory, ItemNotFoundInInventory
+from .data.character.inventory.inventory import (
+    Inventory,
+    InventoryItem,
+    ItemNotFoundInInventory,
+    stack_key,
+)
+from .data.character.inventory.pages import MAX_LENGTH, InventoryPage, InventoryPages
 from .data.item.item import Item, ItemNotFound
+from .data.item.search import normalize
+from .data.item.transfer import ITEM_CLASSES, FORMATS
+from .data.cache import LRUCache
+from .data.fight.combat import Fighter
+from .data.fight.scheduler import FightScheduler
+from .data.monitoring import (
+    CommandStats,
+    CommandTrace,
+    QueryCounter,
+    instrument_http,
+)
+from .data.repository import CharacterRepository, ItemRepository
+from .data.watchdog import LoopWatchdog
 from .config import config
+from .data.session.fight_session import FightSession
 from .data.session.register_char_session import RegisterSession
+from .data.session.registry import SessionRegistry
 
 Cog = getattr(commands, "Cog", object)
+log = logging.getLogger("red.rpg")
 
 
 class RPG(Cog):
@@ -39,9 +65,45 @@ class RPG(Cog):
         self.InventoryClass = Inventory
         self.AttributesClass = Attributes
         self.EquipmentClass = Equipment
-        self.register_sessions = []
+        self.register_sessions = SessionRegistry(config.sessions.register_ttl)
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.database.get("workers", 4),
+            thread_name_prefix="rpg-db",
+        )
+        self.characters = CharacterRepository(
+            self.Red.loop,
+            self.executor,
+            self.CharacterClass,
+            LRUCache(
+                config.cache.characters.max_size, config.cache.characters.ttl
+            ),
+            config.database.get("flush_interval", 0),
+            config.database.get("flush_size", 500),
+            config.database.get("flush_retries", 3),
+        )
+        self.items = ItemRepository(self.Red.loop, self.executor, self.ItemClass)
+        self.command_stats = CommandStats(config.monitoring.window)
+        self._restore_http = instrument_http(self.Red.http)
+        self.watchdog = None
+        if config.monitoring.watchdog.enabled:
+            self.watchdog = LoopWatchdog(
+                self.Red.loop,
+                config.monitoring.watchdog.threshold,
+                config.monitoring.watchdog.interval,
+            )
+            self.watchdog.start()
+        self.embeds = LRUCache(config.cache.embeds.max_size)
+        self.race_templates = race_templates(config.race_stats)
+        self.fights = FightScheduler(
+            self.Red,
+            config.sessions.fight_turn_timeout,
+            config.sessions.fight_tick,
+            config.sessions.fight_edit_workers,
+            config.sessions.max_fights,
+        )
         self.Red.loop.create_task(self.setup())
         self.Red.loop.create_task(self.change_status())
+        self.Red.loop.create_task(self.expire_sessions())
 
     async def setup(self):
         await self.Red.wait_until_ready()
@@ -52,7 +114,59 @@ class RPG(Cog):
             port=config.database.port,
             username=config.database.user,
             password=config.database.password,
+            event_listeners=[QueryCounter()],
         )
+        await self.characters.run(self.CharacterClass.mark_regen_candidates)
+        await self.characters.run(self.CharacterClass.stamp_regen_start)
+        await self.items.load()
+
+    def cog_unload(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self._restore_http()
+        self.fights.close()
+        try:
+            self.characters.flush_sync()
+        except Exception:
+            log.exception("Failed to write the dirty characters on unload")
+        self.executor.shutdown(wait=False)
+
+    # Red 3.0 calls the old-style hooks only
+    __unload = cog_unload
+
+    async def cog_before_invoke(self, ctx):
+        ctx.trace = CommandTrace().start()
+
+    async def cog_after_invoke(self, ctx):
+        trace = getattr(ctx, "trace", None)
+        if trace is None:
+            return
+        trace.stop()
+        name = ctx.command.qualified_name
+        wall = trace.elapsed
+        self.command_stats.observe(name, trace, wall)
+        log.debug(
+            "Command %s took %.1f ms: %d queries, db %.1f ms, discord %.1f ms",
+            name,
+            wall * 1000,
+            trace.queries,
+            trace.db_time * 1000,
+            trace.discord_time * 1000,
+        )
+
+    __before_invoke = cog_before_invoke
+    __after_invoke = cog_after_invoke
+
+    async def expire_sessions(self):
+        """Periodically stops abandoned registration sessions.
+
+        The interval can be changed in the config in the `sessions` section.
+
+        """
+        await self.Red.wait_until_ready()
+        while not self.Red.is_closed():
+            self.register_sessions.expire()
+            await sleep(config.sessions.sweep_interval)
 
     async def change_status(self):
         """Changes the bot status through random time.
@@ -63,7 +177,7 @@ class RPG(Cog):
         """
         await self.Red.wait_until_ready()
         _config = config.bot
-        status = _config.statuses[:]
+        status = list(_config.statuses)
         random.shuffle(status)
         statuses = it.cycle(status)
 
@@ -81,36 +195,145 @@ class RPG(Cog):
                 random.randint(_config.status_change_min, _config.status_change_max)
             )
 
-    async def update_chars(self):
-        await self.Red.wait_until_ready()
-        timer = 5
-        while not self.Red.is_closed():
-            # Attributes regeneration
-            chars = self.CharacterClass.objects
-            for char in chars:
-                char.attributes.mod_value(
-                    "health",
-                    char.attributes.main["health_max"]
-                    * char.attributes.main["health_regen"]
-                    * timer
-                    / 100,
-                )
-                char.attributes.mod_value(
-                    "stamina",
-                    char.attributes.main["stamina_max"]
-                    * char.attributes.main["stamina_regen"]
-                    * timer
-                    / 100,
-                )
-                char.attributes.mod_value(
-                    "magicka",
-                    char.attributes.main["magicka_max"]
-                    * char.attributes.main["magicka_regen"]
-                    * timer
-                    / 100,
-                )
-                char.save()
-            await sleep(timer)
+    @checks.is_owner()
+    @commands.group()
+    async def rpg(self, ctx):
+        """Управление RPG"""
+
+    @rpg.command(name="cache")
+    async def rpg_cache(self, ctx):
+        """Статистика кэша персонажей"""
+
+        text = "```\n"
+        for cache, stats in (
+            ("characters", self.characters.cache.stats),
+            ("write-behind", self.characters.write_stats),
+            ("embeds", self.embeds.stats),
+        ):
+            text += f"[{cache}]\n"
+            for name, value in stats.items():
+                text += f"{name}: {value}\n"
+        text += "```"
+        await ctx.send(text)
+
+    @rpg.command(name="reloadconfig")
+    async def rpg_reloadconfig(self, ctx):
+        """Перезагрузить config.json"""
+
+        try:
+            await self.characters.run(config.reload)
+        except (OSError, ValueError, KeyError) as e:
+            await ctx.send(f"Не удалось загрузить конфиг: {e}")
+            return
+        self.embeds.clear()
+        self.race_templates = race_templates(config.race_stats)
+        await ctx.send("Конфиг перезагружен.")
+
+    @rpg.command(name="queries")
+    async def rpg_queries(self, ctx):
+        """Количество запросов к базе данных по командам"""
+
+        if not self.command_stats.commands:
+            await ctx.send("Нет данных.")
+            return
+        text = "```\ncommand: calls, avg, max\n"
+        for name, histograms in sorted(self.command_stats.commands.items()):
+            queries = histograms["queries"].total
+            text += f"{name}: {queries.count}, {queries.mean:.1f}, {queries.max:.0f}\n"
+        text += "```"
+        await ctx.send(text)
+
+    @rpg.group(name="perf", invoke_without_command=True)
+    async def rpg_perf(self, ctx):
+        """Время выполнения команд за последние минуты"""
+
+        stats = self.command_stats
+        rows = []
+        for name, histograms in sorted(stats.commands.items()):
+            wall = histograms["wall"].window()
+            if not wall.count:
+                continue
+            rows.append(
+                f"{name}: {wall.count}, "
+                f"{wall.quantile(0.5) * 1000:.0f}/{wall.quantile(0.95) * 1000:.0f}/"
+                f"{wall.max * 1000:.0f}, "
+                f"{histograms['db'].window().mean * 1000:.0f}, "
+                f"{histograms['discord'].window().mean * 1000:.0f}, "
+                f"{histograms['queries'].window().mean:.1f}"
+            )
+        if not rows:
+            await ctx.send("Нет данных.")
+            return
+        header = (
+            f"last {stats.window / 60:.0f} min, ms\n"
+            "command: calls, p50/p95/max, db avg, discord avg, queries avg\n"
+        )
+        for page in pagify(header + "\n".join(rows), page_length=1900):
+            await ctx.send(box(page))
+
+    @rpg_perf.command(name="prometheus")
+    async def rpg_perf_prometheus(self, ctx):
+        """Гистограммы команд в формате Prometheus"""
+
+        text = self.command_stats.prometheus()
+        await ctx.send(
+            file=discord.File(io.BytesIO(text.encode()), filename="rpg_metrics.txt")
+        )
+
+    @rpg.group(name="stalls", invoke_without_command=True)
+    async def rpg_stalls(self, ctx, limit: int = 10):
+        """Блокировки цикла событий по местам вызова"""
+
+        if self.watchdog is None:
+            await ctx.send(
+                "Сторожевой таймер выключен. "
+                "Включите `monitoring.watchdog.enabled` в config.json."
+            )
+            return
+        lag = self.watchdog.lag
+        text = (
+            f"loop lag: p50 {lag.quantile(0.5) * 1000:.1f} ms, "
+            f"p95 {lag.quantile(0.95) * 1000:.1f} ms, max {lag.max * 1000:.0f} ms\n"
+            "site: count, total, max\n"
+        )
+        reports = self.watchdog.reports(limit)
+        for report in reports:
+            text += (
+                f"{report.site}: {report.count}, {report.total * 1000:.0f} ms, "
+                f"{report.max * 1000:.0f} ms\n"
+            )
+        if reports:
+            text += "\nlongest stall of the first site:\n" + "".join(
+                reports[0].stack[-8:]
+            )
+        for page in pagify(text, page_length=1900):
+            await ctx.send(box(page))
+
+    @rpg_stalls.command(name="reset")
+    async def rpg_stalls_reset(self, ctx):
+        """Сбросить статистику блокировок"""
+
+        if self.watchdog is not None:
+            self.watchdog.reset()
+        await ctx.send("Статистика блокировок сброшена.")
+
+    @rpg.command(name="fights")
+    async def rpg_fights(self, ctx):
+        """Состояние планировщика боев"""
+
+        latency = self.fights.latency()
+        await ctx.send(
+            "```\n"
+            f"active: {self.fights.active}/{self.fights.max_fights}\n"
+            f"timers: {len(self.fights.wheel)}\n"
+            f"edit queue: {self.fights.queue_depth}\n"
+            f"turn latency ({latency['count']}): "
+            f"mean {latency['mean'] * 1000:.0f} ms, "
+            f"p50 {latency['p50'] * 1000:.0f} ms, "
+            f"p95 {latency['p95'] * 1000:.0f} ms, "
+            f"max {latency['max'] * 1000:.0f} ms\n"
+            "```"
+        )
 
     @commands.group(invoke_without_command=True, aliases=["char", "персонаж", "перс"])
     async def character(self, ctx, member: Union[discord.Member, discord.User] = None):
@@ -121,12 +344,39 @@ class RPG(Cog):
             member = author
         member_id = str(member.id)
         try:
-            char = Character.get_char_by_id(member_id)
+            char = await self.characters.get(member_id)
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             await ctx.send_help()
             return
 
+        health = self._attribute_text(char, "health")
+        embed = self.embeds.get_or_set(
+            ("character", member_id, self.characters.version(member_id), health),
+            lambda: self._character_embed(char, health),
+        )
+        await ctx.send(embed=embed)
+
+    @staticmethod
+    def _attribute_text(char: Character, attribute: str) -> str:
+        value = int(getattr(char.attributes, attribute))
+        total = int(char.attributes.get_total_value(attribute))
+        return f"{value}/{total}"
+
+    @staticmethod
+    def _character_embed(char: Character, health: str) -> discord.Embed:
+        """Returns the embed with the character information.
+
+        Rendered embeds are cached, so the returned embed must not be changed.
+
+        Args:
+            char (Character): Character to show.
+            health (str): Current and total health.
+
+        Returns:
+            discord.Embed: Character embed.
+
+        """
         embed = discord.Embed(
             title=f"{char.name}",
             colour=discord.Colour(0xF5A623),
@@ -139,15 +389,11 @@ class RPG(Cog):
 
         embed.add_field(name="Раса", value=config.humanize.races[char.race].title())
         embed.add_field(name="Пол", value=config.humanize.genders[char.sex].title())
-        embed.add_field(
-            name="Здоровье",
-            value=f"{int(char.attributes.health)}/{int(char.attributes.get_total_value('health'))}",
-        )
+        embed.add_field(name="Здоровье", value=health)
         embed.add_field(name="Уровень", value=char.lvl)
         embed.add_field(name="Опыт", value=char.xp)
         embed.add_field(name="Множитель опыта", value=char.xp_factor)
-
-        await ctx.send(embed=embed)
+        return embed
 
     @character.command(name="new", aliases=["новый"])
     async def char_new(self, ctx):
@@ -155,7 +401,7 @@ class RPG(Cog):
 
         author = ctx.author
 
-        if self.CharacterClass.is_member_registered(str(author.id)):
+        if await self.characters.exists(str(author.id)):
             await ctx.send(
                 f"{author.mention}, у вас уже есть персонаж. "
                 f"Введите `{ctx.prefix}char delete`, чтобы удалить его."
@@ -165,7 +411,7 @@ class RPG(Cog):
         if session is not None:
             return
         session = RegisterSession.start(ctx)
-        self.register_sessions.append(session)
+        self.register_sessions.add(author.id, session)
 
     @character.command(name="cancel", aliases=["отмена"])
     async def char_cancel(self, ctx):
@@ -185,7 +431,7 @@ class RPG(Cog):
         author = ctx.author
         member_id = str(author.id)
 
-        if not self.CharacterClass.is_member_registered(member_id):
+        if not await self.characters.exists(member_id):
             await ctx.send(
                 f"{author.mention}, у вас нет персонажа. "
                 f"Введите `{ctx.prefix}char new`, чтобы создать"
@@ -207,7 +453,7 @@ class RPG(Cog):
             await ctx.send(f"{author.mention}, удаление персонажа отменено.")
             return
         if msg.content.lower() in ["да", "д", "yes", "y"]:
-            self.CharacterClass.objects(member_id=member_id).delete()
+            await self.characters.delete(member_id)
             await ctx.send(
                 f"{author.mention}, ваш персонаж удален. "
                 f"Введите `{ctx.prefix}char new`, чтобы создать нового."
@@ -215,6 +461,73 @@ class RPG(Cog):
         else:
             await ctx.send(f"{author.mention}, удаление персонажа отменено.")
 
+    @commands.command(aliases=["дуэль"])
+    async def duel(self, ctx, opponent: discord.Member):
+        """Вызвать персонажа на дуэль"""
+
+        author = ctx.author
+        if opponent == author or opponent.bot:
+            await ctx.send(f"{author.mention}, выберите другого противника.")
+            return
+        member_ids = (author.id, opponent.id)
+        if not self.fights.reserve(member_ids):
+            busy = [m for m in (author, opponent) if self.fights.is_busy(m.id)]
+            if busy:
+                await ctx.send(
+                    f"{author.mention}, {busy[0].display_name} уже сражается."
+                )
+            else:
+                await ctx.send(f"{author.mention}, сейчас идет слишком много боев.")
+            return
+        try:
+            chars = []
+            for member in (author, opponent):
+                try:
+                    char = await self.characters.get(str(member.id))
+                except CharacterNotFound:
+                    await ctx.send(
+                        f"{author.mention}, у {member.display_name} нет персонажа."
+                    )
+                    self.fights.release(member_ids)
+                    return
+                if char.attributes.health < 1:
+                    await ctx.send(
+                        f"{author.mention}, {char.name} слишком слаб для боя."
+                    )
+                    self.fights.release(member_ids)
+                    return
+                chars.append(char)
+            fighters = await self._fighters(chars)
+        except Exception:
+            self.fights.release(member_ids)
+            raise
+        session = FightSession(ctx, chars[0], opponent, chars[1], fighters)
+        await self.fights.start(session)
+
+    async def _fighters(self, chars: list) -> tuple:
+        """Creates fighters of the characters with their equipped weapons.
+
+        Args:
+            chars (list): Characters.
+
+        Returns:
+            tuple: Fighters in the order of the characters.
+
+        """
+        slots = [char.equipment.item_ids() for char in chars]
+        resolved = await self.items.resolve(
+            item_id for eqpt in slots for item_id in eqpt.values()
+        )
+        return tuple(
+            Fighter.from_attributes(
+                char.name,
+                char.attributes,
+                resolved.get(eqpt.get("right_hand")),
+                resolved.get(eqpt.get("left_hand")),
+            )
+            for char, eqpt in zip(chars, slots)
+        )
+
     @commands.group(aliases=["inv", "инвентарь", "инв"], invoke_without_command=True)
     async def inventory(self, ctx, member: Union[discord.Member, discord.User] = None):
         """Инвентарь персонажа"""
@@ -224,7 +537,7 @@ class RPG(Cog):
             member = author
 
         try:
-            char = self.CharacterClass.get_char_by_id(str(member.id))
+            char = await self.characters.get(str(member.id))
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
@@ -238,54 +551,149 @@ class RPG(Cog):
             await ctx.send(embed=_embed)
             return
 
-        pages = []
-        for category, name in config.humanize.inventory.inv_categories.items():
-            inventory = char.inventory
-            items = list(inventory[category.lower()])
-            if not items:
-                continue
-            item_stats = []
-            for item in items:
-                count = item.count
-                if item and count > 0:
-                    try:
-                        stats = {**{"count": count}, **dict(item.item.to_mongo())}
-                        if item.maker:
-                            stats["maker"] = item.maker
-                        if item.temper:
-                            stats["temper"] = item.temper
-                        item_stats.append(stats)
-                    except ItemNotFound:
-                        print(
-                            f"Item ID: {item['item_id']} not found. Member ID: {member.id}"
-                        )
-                else:
-                    break
-            else:
-                item_stats[:] = sorted(item_stats, key=itemgetter("name"))
-                embed = discord.Embed(
-                    title=f"Инвентарь персонажа {char.name}",
-                    colour=discord.Colour(0x8B572A),
-                    description=f"**```fix\n[{name.upper()}] ({len(item_stats)})\n```**",
+        item_ids = char.inventory.item_ids()
+        lookup = await self.items.lookup(item_ids)
+        for item_id in item_ids:
+            if lookup(item_id) is None:
+                log.warning("Item ID: %s not found. Member ID: %s", item_id, member.id)
+        pages = InventoryPages(
+            char.inventory, lookup, list(config.inventory_categories)
+        )
+
+        async def render(page: InventoryPage) -> discord.Embed:
+            items = await self.items.resolve(
+                stack_key(stack)[0] for stack in page.entries
+            )
+            return self._inventory_page(char, page, items)
+
+        if pages.categories:
+            await self._page_menu(ctx, pages, render)
+
+    @staticmethod
+    def _inventory_field(stack: InventoryItem, item: Item) -> tuple:
+        """Returns the name and the value of the embed field of the stack.
+
+        Args:
+            stack (InventoryItem): Inventory item.
+            item (Item): Item of the stack.
+
+        Returns:
+            tuple: Field name and value.
+
+        """
+        stats = {**{"count": stack.count}, **dict(item.to_mongo())}
+        if stack.maker:
+            stats["maker"] = stack.maker
+        if stack.temper:
+            stats["temper"] = stack.temper
+        text = "```autohotkey\n"
+        for stat, _name in config.humanize.inventory.inv_stats.items():
+            if stat in stats:
+                text += f"{_name.title()}: {stats[stat]}\n"
+        text += "```"
+        # Discord limits the field name to 256 characters and the value to 1024
+        return f"{stats['name']} ({stats['count']})"[:256], text[:1024]
+
+    @classmethod
+    def _inventory_page(
+        cls, char: Character, page: InventoryPage, items: Mapping[int, Item]
+    ) -> discord.Embed:
+        """Returns the embed of the inventory page.
+
+        Args:
+            char (Character): Owner of the inventory.
+            page (InventoryPage): Page to show.
+            items (Mapping[int, Item]): Items of the page by ID. Stacks of
+                missing items are skipped.
+
+        Returns:
+            discord.Embed: Page embed.
+
+        """
+        name = config.inventory_categories[page.category]
+        embed = discord.Embed(
+            title=f"Инвентарь персонажа {char.name}",
+            colour=discord.Colour(0x8B572A),
+            description=f"**```fix\n[{name.upper()}] ({page.size})\n```**",
+        )
+        embed.set_author(name=config.bot.name, icon_url=config.bot.icon_url)
+        embed.set_footer(
+            text=f"Инвентарь персонажа • Страница {page.number}/{page.total}"
+        )
+        fields = [
+            cls._inventory_field(stack, items[stack_key(stack)[0]])
+            for stack in page.entries
+            if stack_key(stack)[0] in items
+        ]
+        for name, text in cls._fit_fields(fields, MAX_LENGTH):
+            embed.add_field(name=name, value=text, inline=True)
+        return embed
+
+    @staticmethod
+    def _fit_fields(fields: list, max_length: int) -> list:
+        """Shortens the embed fields to fit their total length.
+
+        If the fields are too long, each of them gets an equal share of the
+        length. Stat lines that do not fit are cut off, and the code block is
+        kept closed.
+
+        Args:
+            fields (list): Field names and values.
+            max_length (int): The maximum total length of the fields.
+
+        Returns:
+            list: Field names and values.
+
+        """
+        if sum(len(name) + len(text) for name, text in fields) <= max_length:
+            return fields
+        share = max_length // len(fields)
+        fitted = []
+        for name, text in fields:
+            name = name[: share // 2]
+            room = share - len(name)
+            if len(text) > room:
+                text = text[: room - 4].rsplit("\n", 1)[0] + "\n```"
+            fitted.append((name, text))
+        return fitted
+
+    async def _page_menu(self, ctx, pages, render, timeout: float = 30.0):
+        """Shows lazily rendered pages with reaction controls.
+
+        Unlike `menu`, only the page being shown is rendered, so pages can be
+        produced on demand.
+
+        Args:
+            ctx (commands.Context): Command context.
+            pages: Page source with `first`, `next` and `previous` methods.
+            render (Callable): Coroutine function that returns the embed of a
+                page.
+            timeout (float): Seconds to wait for a reaction. Defaults to 30.
+        """
+        controls = ("⬅", "❌", "➡") if len(pages) > 1 else ("❌",)
+        message = await ctx.send(embed=await render(pages.first()))
+        start_adding_reactions(message, controls)
+        predicate = ReactionPredicate.with_emojis(controls, message, ctx.author)
+        while True:
+            try:
+                react, user = await self.Red.wait_for(
+                    "reaction_add", timeout=timeout, check=predicate
                 )
-                embed.set_author(name=config.bot.name, icon_url=config.bot.icon_url)
-                embed.set_footer(text="Инвентарь персонажа")
-                for stats in item_stats:
-                    text = "```autohotkey\n"
-                    for stat, _name in config.humanize.inventory.inv_stats.items():
-                        if stat in stats:
-                            text += f"{_name.title()}: {stats[stat]}\n"
-                    text += "```"
-                    embed.add_field(
-                        name=f"{stats['name']} ({stats['count']})",
-                        value=text,
-                        inline=True,
-                    )
-                pages.append(embed)
-        if len(pages) > 1:
-            await menu(ctx, pages, DEFAULT_CONTROLS)
-        elif len(pages) == 1:
-            await menu(ctx, pages, {"❌": close_menu})
+            except TimeoutError:
+                try:
+                    await message.clear_reactions()
+                except (discord.Forbidden, discord.NotFound):
+                    pass
+                return
+            if react.emoji == "❌":
+                await message.delete()
+                return
+            page = pages.next() if react.emoji == "➡" else pages.previous()
+            try:
+                await message.remove_reaction(react.emoji, user)
+            except discord.Forbidden:
+                pass
+            await message.edit(embed=await render(page))
 
     @checks.admin_or_permissions()
     @inventory.command(name="add", pass_context=True, aliases=["выдать"])
@@ -304,7 +712,7 @@ class RPG(Cog):
         member_id = str(member.id)
 
         try:
-            char = Character.get_char_by_id(member_id)
+            char = await self.characters.get(member_id)
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
@@ -317,8 +725,11 @@ class RPG(Cog):
 
         if temper:
             temper = int(temper)
-        char.inventory.add_item(_item, int(count), maker, temper)
-        char.save()
+        async with self.characters.lock(member_id):
+            await self.characters.run(
+                char.inventory.add_item, _item, int(count), maker, temper
+            )
+            await self.characters.save(char)
         await ctx.send(f"{author.mention}, предмет(ы) добавлен(ы).")
 
     @checks.admin_or_permissions()
@@ -331,7 +742,7 @@ class RPG(Cog):
         author = ctx.author
 
         try:
-            char = Character.get_char_by_id(str(member.id))
+            char = await self.characters.get(str(member.id))
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
@@ -343,15 +754,22 @@ class RPG(Cog):
             return
 
         try:
-            items = char.inventory.get_items(_item)
+            items = await self.characters.run(char.inventory.get_items, _item)
             if len(items) > 1:
                 item = await self.item_select(ctx, _item, list(items))
             elif len(items) == 1:
-                item = items.first()
+                item = items[0]
             else:
                 raise ItemNotFoundInInventory
-            char.inventory.remove_item(_item, int(count), item["maker"], item["temper"])
-            char.save()
+            async with self.characters.lock(char.member_id):
+                await self.characters.run(
+                    char.inventory.remove_item,
+                    _item,
+                    int(count),
+                    item["maker"],
+                    item["temper"],
+                )
+                await self.characters.save(char)
             await ctx.send(f"{author.mention}, предмет(ы) удален(ы).")
         except ItemNotFoundInInventory:
             await ctx.send(f"{author.mention}, предмет не найден в инвентаре.")
@@ -365,11 +783,24 @@ class RPG(Cog):
         author = ctx.author
         if member is None:
             member = author
+        member_id = str(member.id)
         try:
-            char = Character.get_char_by_id(str(member.id))
+            char = await self.characters.get(member_id)
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
+
+        key = (
+            "equipment",
+            member_id,
+            self.characters.version(member_id),
+            self.items.revision,
+        )
+        embed = self.embeds.get(key)
+        if embed is not None:
+            await ctx.send(embed=embed)
+            return
+
         embed = discord.Embed(
             title=f"Снаряжение персонажа {char.name}", colour=discord.Colour(0x8B572A)
         )
@@ -377,11 +808,17 @@ class RPG(Cog):
         embed.set_author(name=config.bot.name, icon_url=config.bot.icon_url)
         embed.set_footer(text="Снаряжение персонажа")
 
-        eqpt = char.equipment.to_dict()
+        slots = char.equipment.item_ids()
+        resolved = await self.items.resolve(slots.values())
+        eqpt = {
+            slot: resolved[item_id].name
+            for slot, item_id in slots.items()
+            if item_id in resolved
+        }
 
         for slot, name in config.humanize.inventory.equipment.items():
             try:
-                value = eqpt[slot].item.name
+                value = eqpt[slot]
             except KeyError:
                 value = "Пусто"
             embed.add_field(
@@ -390,6 +827,7 @@ class RPG(Cog):
                 inline=True,
             )
 
+        self.embeds.set(key, embed)
         await ctx.send(embed=embed)
 
     @inventory.command(name="equip", aliases=["экипировать", "надеть"])
@@ -398,7 +836,7 @@ class RPG(Cog):
 
         author = ctx.author
         try:
-            char = Character.get_char_by_id(str(author.id))
+            char = await self.characters.get(str(author.id))
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
@@ -410,15 +848,16 @@ class RPG(Cog):
             return
 
         try:
-            items = char.inventory.get_items(_item)
+            items = await self.characters.run(char.inventory.get_items, _item)
             if len(items) > 1:
                 item = await self.item_select(ctx, _item, list(items))
             elif len(items) == 1:
-                item = items.first()
+                item = items[0]
             else:
                 raise ItemNotFoundInInventory
-            char.equipment.equip_item(item)
-            char.save()
+            async with self.characters.lock(char.member_id):
+                await self.characters.run(char.equipment.equip_item, item)
+                await self.characters.save(char)
             await ctx.send(f"{author.mention}, предмет экипирован.")
         except ItemNotFoundInInventory:
             await ctx.send(f"{author.mention}, предмет не найден в инвентаре.")
@@ -432,7 +871,7 @@ class RPG(Cog):
         author = ctx.author
 
         try:
-            char = Character.get_char_by_id(str(author.id))
+            char = await self.characters.get(str(author.id))
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
@@ -444,8 +883,9 @@ class RPG(Cog):
             return
 
         try:
-            char.equipment.unequip_item(_item)
-            char.save()
+            async with self.characters.lock(char.member_id):
+                await self.characters.run(char.equipment.unequip_item, _item)
+                await self.characters.save(char)
             await ctx.send(f"{author.mention}, предмет снят.")
         except ItemNotFoundInEquipment:
             await ctx.send(f"{author.mention}, предмет не найден в снаряжении.")
@@ -461,22 +901,38 @@ class RPG(Cog):
             await ctx.send(f"{author.mention}, предмет не найден.")
             return
 
-        color = discord.Colour(
-            int(getattr(config.game.item_settings.colors, _item.rarity.lower()), 0)
+        embed = self.embeds.get_or_set(
+            ("item", _item.item_id, self.items.version(_item.item_id)),
+            lambda: self._item_embed(_item),
         )
+        await ctx.send(embed=embed)
+
+    def _item_embed(self, item: Item) -> discord.Embed:
+        """Returns the embed with the item information.
+
+        Rendered embeds are cached, so the returned embed must not be changed.
+
+        Args:
+            item (Item): Item to show.
+
+        Returns:
+            discord.Embed: Item embed.
+
+        """
         embed = discord.Embed(
-            title=f"{_item.name}", colour=color, description=f"*{_item.desc}*"
+            title=f"{item.name}",
+            colour=discord.Colour(config.item_colours[item.rarity.lower()]),
+            description=f"*{item.desc}*",
         )
 
         embed.set_author(name=config.bot.name, icon_url=config.bot.icon_url)
         embed.set_footer(text="Информация о предмете")
         for stat, name in config.humanize.inventory.inv_stats.items():
-            if stat in _item:
+            if stat in item:
                 embed.add_field(
-                    name=name.title(), value=f"{getattr(_item, stat)}", inline=True
+                    name=name.title(), value=f"{getattr(item, stat)}", inline=True
                 )
-
-        await ctx.send(embed=embed)
+        return embed
 
     @checks.is_owner()
     @item.command(name="new", invoke_without_command=True, aliases=["новый"])
@@ -504,9 +960,9 @@ class RPG(Cog):
                 *--- armor:* Класс брони
         """
 
-        item_id = self.ItemClass.get_next_id()
+        item_id = await self.items.next_id()
 
-        new_item = globals()[item_type.title()](
+        new_item = ITEM_CLASSES[item_type.lower()](
             item_id=item_id,
             name=item_name,
             desc=description,
@@ -519,14 +975,77 @@ class RPG(Cog):
             for arg, value in zip(signature[args_len:], list(args)):
                 setattr(new_item, arg, value)
 
-        new_item.save()
+        await self.items.save(new_item)
         await ctx.send(f"{ctx.author.mention}, предмет создан!")
 
-    @staticmethod
-    def convert_mention(member_id: str):
+    @checks.is_owner()
+    @item.command(name="import", aliases=["импорт"])
+    async def item_import(self, ctx, chunk_size: int = 500):
+        """Импортировать предметы из файла
+
+        К сообщению должен быть приложен файл в формате JSON Lines (.jsonl) или
+        CSV (.csv). Каждая строка описывает один предмет: поле `type`
+        (item/weapon/armor) и поля предмета.
+
+        *- chunk_size:* Количество предметов, записываемых за один запрос
+        """
+
+        author = ctx.author
+        if not ctx.message.attachments:
+            await ctx.send(f"{author.mention}, приложите файл с предметами.")
+            return
+        attachment = ctx.message.attachments[0]
+        fmt = attachment.filename.rsplit(".", 1)[-1].lower()
+        if fmt not in FORMATS:
+            await ctx.send(
+                f"{author.mention}, поддерживаются только форматы: {', '.join(FORMATS)}."
+            )
+            return
+
+        with tempfile.TemporaryFile() as buffer:
+            await attachment.save(buffer)
+            buffer.seek(0)
+            stream = io.TextIOWrapper(buffer, encoding="utf-8-sig", newline="")
+            report = await self.items.import_items(stream, fmt, chunk_size)
+            stream.detach()
+
+        text = f"{author.mention}, импорт завершен: {report}."
+        if report.errors:
+            text += "```\n"
+            for number, error in report.errors[:10]:
+                text += f"[{number}] {error}\n"
+            text += "```"
+        await ctx.send(text)
+
+    @checks.is_owner()
+    @item.command(name="export", aliases=["экспорт"])
+    async def item_export(self, ctx, fmt: str = "jsonl"):
+        """Экспортировать все предметы в файл
+
+        *- fmt:* Формат файла. Возможные значения: jsonl/csv
+        """
+
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            await ctx.send(
+                f"{ctx.author.mention}, поддерживаются только форматы: {', '.join(FORMATS)}."
+            )
+            return
+
+        with tempfile.TemporaryFile() as data:
+            stream = io.TextIOWrapper(data, encoding="utf-8", newline="")
+            report = await self.items.export_items(stream, fmt)
+            stream.detach()
+            data.seek(0)
+            await ctx.send(
+                f"{ctx.author.mention}, экспорт завершен: {report}.",
+                file=discord.File(data, filename=f"items.{fmt}"),
+            )
+
+    async def convert_mention(self, member_id: str):
         print(member_id)
         try:
-            return Character.get_char_by_id(member_id).name
+            return (await self.characters.get(member_id)).name
         except CharacterNotFound:
             return "незнакомец(-ка)"
 
@@ -541,31 +1060,60 @@ class RPG(Cog):
         print(message)
 
         try:
-            char = Character.get_char_by_id(str(author.id))
+            char = await self.characters.get(str(author.id))
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
-        message = re.sub(
-            r"<@(!)?(\d*)>", lambda m: self.convert_mention(m.group(2)), message
-        )
+        pattern = r"<@(!)?(\d*)>"
+        names = {
+            member_id: await self.convert_mention(member_id)
+            for member_id in {m.group(2) for m in re.finditer(pattern, message)}
+        }
+        message = re.sub(pattern, lambda m: names[m.group(2)], message)
 
         await ctx.message.delete()
         await ctx.send(f"***{char.name}*** *{message}*")
 
     @commands.command(aliases=["stats", "статы"])
     async def statistics(self, ctx, member: Union[discord.Member, discord.User] = None):
-        """ Характеристики персонажа """
+        """Характеристики персонажа"""
 
         author = ctx.author
         if member is None:
             member = author
+        member_id = str(member.id)
 
         try:
-            char = Character.get_char_by_id(str(member.id))
+            char = await self.characters.get(member_id)
         except CharacterNotFound:
             await ctx.send(f"{author.mention}, персонаж не найден.")
             return
 
+        values = {
+            stat: self._attribute_text(char, stat)
+            for stat in ["magicka", "health", "stamina"]
+        }
+        key = ("statistics", member_id, self.characters.version(member_id))
+        pages = self.embeds.get_or_set(
+            key + tuple(values.values()),
+            lambda: self._statistics_pages(char, values),
+        )
+        await menu(ctx, pages, DEFAULT_CONTROLS)
+
+    @staticmethod
+    def _statistics_pages(char: Character, values: dict) -> list:
+        """Returns the embeds with the character attributes.
+
+        Rendered embeds are cached, so the returned embeds must not be changed.
+
+        Args:
+            char (Character): Character to show.
+            values (dict): Current and total magicka, health and stamina.
+
+        Returns:
+            list: Embed for every attribute category.
+
+        """
         pages = []
         _config = config.humanize.attributes
         for category, name in _config.categories.items():
@@ -577,8 +1125,7 @@ class RPG(Cog):
             embed.set_author(name=config.bot.name, icon_url=config.bot.icon_url)
             embed.set_footer(text="Характеристики персонажа")
             if category == "main":
-                for stat in ["magicka", "health", "stamina"]:
-                    value = f"{int(getattr(char.attributes, stat))}/{int(char.attributes.get_total_value(stat))}"
+                for stat, value in values.items():
                     embed.add_field(name=_config.stats[stat], value=value, inline=True)
                 embed.add_field(
                     name="Класс брони",
@@ -601,8 +1148,7 @@ class RPG(Cog):
                     value = char.attributes.skills[skill]
                     embed.add_field(name=_config.stats[skill], value=value, inline=True)
             pages.append(embed)
-
-        await menu(ctx, pages, DEFAULT_CONTROLS)
+        return pages
 
     async def on_register_end(self, session: RegisterSession):
         """Event for a registration session ending.
@@ -614,30 +1160,48 @@ class RPG(Cog):
         Args:
             session (RegisterSession): The session which has just ended.
         """
-        if session in self.register_sessions:
-            self.register_sessions.remove(session)
+        self.register_sessions.pop(session.ctx.author.id, session)
         if session.complete:
-            inventory = self.InventoryClass()
-            race_attrs = config.game.races[session.char["race"]]
-            attributes = self.AttributesClass(
-                race_attrs.main,
-                race_attrs.resists,
-                race_attrs.skills,
-                race_attrs.unarmed_damage,
-            )
-            attributes.restore_values()
-            equipment = self.EquipmentClass()
-            char = self.CharacterClass(
+            char = self.CharacterClass.create(
                 member_id=session.char["member_id"],
                 name=session.char["name"],
                 race=session.char["race"],
                 sex=session.char["sex"],
                 desc=session.char["desc"],
-                inventory=inventory,
-                attributes=attributes,
-                equipment=equipment,
+                template=self.race_templates[session.char["race"]],
             )
-            char.save()
+            await self.characters.save(char)
+
+    async def on_fight_end(self, session: FightSession):
+        """Event for a fight session ending.
+
+        If the fight took place, this method saves health, stamina and magicka of both characters
+        with a single request. The characters may have changed during the fight, so the result
+        is applied to their current objects rather than the ones taken at the start.
+
+        Args:
+            session (FightSession): The session which has just ended.
+        """
+        if not session.complete:
+            return
+        member_ids = [str(member.id) for member in session.members]
+        chars = []
+        async with self.characters.lock_all(member_ids):
+            for member_id, fighter in zip(member_ids, session.fighters):
+                try:
+                    char = await self.characters.get(member_id)
+                except CharacterNotFound:
+                    continue
+                fighter.apply_to(char.attributes)
+                char.record_vitals()
+                chars.append(char)
+            await self.characters.save_all(chars)
+
+    async def on_reaction_add(self, reaction: discord.Reaction, user):
+        self.fights.on_reaction(reaction, user)
+
+    async def on_reaction_remove(self, reaction: discord.Reaction, user):
+        self.fights.on_reaction(reaction, user)
 
     def _get_register_session(
         self, author: Union[discord.Member, discord.User]
@@ -651,30 +1215,32 @@ class RPG(Cog):
             RegisterSession: Registration session
 
         """
-        return next(
-            (
-                session
-                for session in self.register_sessions
-                if session.ctx.author == author
-            ),
-            None,
-        )
+        return self.register_sessions.get(author.id)
 
     async def get_item_by_name(self, ctx, name: str) -> Item:
         """Returns the item by the given name.
 
+        If there is no item with exactly this name, the best matches of the
+        item search are used. If several items match, the member is asked to
+        select one of them. A single partial or misspelled match must be
+        confirmed by the member.
+
         Args:
             ctx (commands.Context):
-            name (str): Item name.
+            name (str): Full or partial item name.
 
         Returns:
             Item: Item object.
 
         Raises:
-            ItemNotFound: If the item is not found.
+            ItemNotFound: If the item is not found or the member did not
+                confirm the match.
 
         """
-        items = Item.get_items(name=name)
+        items = await self.items.get_by_name(name)
+        exact = bool(items)
+        if not items:
+            items = await self.items.search(name)
         if not items:
             raise ItemNotFound
         if len(items) > 1:
@@ -699,7 +1265,35 @@ class RPG(Cog):
             finally:
                 await msg.delete()
             return item
-        return items.first()
+        item = items[0]
+        if not exact and normalize(item.name) != normalize(name):
+            await self.confirm_item(ctx, item)
+        return item
+
+    async def confirm_item(self, ctx, item: Item):
+        """Asks the member whether the found item is the one they meant.
+
+        Args:
+            ctx (commands.Context): Command context.
+            item (Item): Found item.
+
+        Raises:
+            ItemNotFound: If the member declined the item or did not answer.
+
+        """
+        msg = await ctx.send(
+            f"{ctx.author.mention}, найден предмет **{item.name}**. Использовать его?"
+        )
+        start_adding_reactions(msg, ReactionPredicate.YES_OR_NO_EMOJIS)
+        predicate = ReactionPredicate.yes_or_no(msg, ctx.author)
+        try:
+            await self.Red.wait_for("reaction_add", timeout=30.0, check=predicate)
+        except TimeoutError:
+            raise ItemNotFound
+        finally:
+            await msg.delete()
+        if not predicate.result:
+            raise ItemNotFound
 
     async def item_select(self, ctx, item, items):
         """
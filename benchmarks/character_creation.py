@@ -0,0 +1,92 @@
+"""Benchmark of character creation with and without race templates.
+
+Characters are saved to mongomock, or to a local MongoDB with --host. Run
+from the directory that contains the cog:
+
+    python -m rpg.benchmarks.character_creation --count 10000
+
+"""
+import argparse
+import time
+
+from mongoengine import connect, disconnect
+
+from ..config import config
+from ..data.character.attributes import Attributes, race_templates
+from ..data.character.character import Character
+from ..data.character.inventory.equipment import Equipment
+from ..data.character.inventory.inventory import Inventory
+
+
+def create_from_config(member_id: str, race: str) -> Character:
+    """Creates a character the way it was done before race templates."""
+    race_attrs = config.game.races[race]
+    attributes = Attributes(
+        dict(race_attrs.main),
+        dict(race_attrs.resists),
+        dict(race_attrs.skills),
+        race_attrs.unarmed_damage,
+    )
+    attributes.restore_values()
+    return Character(
+        member_id=member_id,
+        name="Бенчмарк",
+        race=race,
+        sex="male",
+        desc="Персонаж для бенчмарка.",
+        inventory=Inventory(),
+        attributes=attributes,
+        equipment=Equipment(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--host", default=None, help="MongoDB host. Mongomock if omitted.")
+    args = parser.parse_args()
+
+    if args.host:
+        connect("rpg_benchmark", host=args.host)
+    else:
+        import mongomock
+
+        connect("rpg_benchmark", mongo_client_class=mongomock.MongoClient)
+
+    races = list(config.game.races)
+    started = time.perf_counter()
+    templates = race_templates(config.race_stats)
+    print(f"Templates: {len(templates)} races in {time.perf_counter() - started:.4f} s")
+
+    cases = {
+        "config": lambda member_id, race: create_from_config(member_id, race),
+        "template": lambda member_id, race: Character.create(
+            member_id,
+            "Бенчмарк",
+            race,
+            "male",
+            "Персонаж для бенчмарка.",
+            templates[race],
+        ),
+    }
+    for case, create in cases.items():
+        Character.drop_collection()
+        build = save = 0.0
+        for number in range(args.count):
+            started = time.perf_counter()
+            char = create(str(number), races[number % len(races)])
+            built = time.perf_counter()
+            char.save()
+            build += built - started
+            save += time.perf_counter() - built
+        print(
+            f"{case:>8}: {args.count} characters, "
+            f"build {build / args.count * 1e6:.0f} µs, "
+            f"save {save / args.count * 1e6:.0f} µs per character"
+        )
+    Character.drop_collection()
+    disconnect()
+
+
+if __name__ == "__main__":
+    main()
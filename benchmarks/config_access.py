@@ -0,0 +1,46 @@
+"""Benchmark of config attribute access on hot paths.
+
+Compares the config snapshot with the Munch the config used to be loaded
+into. Run from the directory that contains the cog:
+
+    python -m rpg.benchmarks.config_access
+
+"""
+import argparse
+import json
+import timeit
+
+from ..config import config, config_file_path
+
+LOOKUPS = [
+    "config.bot.icon_url",
+    "config.humanize.inventory.inv_stats",
+    "config.humanize.races['nord']",
+    "config.game.races['nord'].main",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=1000000)
+    args = parser.parse_args()
+
+    candidates = {"snapshot": config}
+    try:
+        from munch import Munch
+    except ImportError:
+        print("munch is not installed, only the snapshot is measured")
+    else:
+        with open(config_file_path) as config_file:
+            candidates["munch"] = Munch.fromDict(json.load(config_file))
+
+    for lookup in LOOKUPS:
+        for name, candidate in candidates.items():
+            elapsed = timeit.timeit(
+                lookup, globals={"config": candidate}, number=args.number
+            )
+            print(f"{lookup:>40} {name:>8}: {elapsed / args.number * 1e9:7.1f} ns")
+
+
+if __name__ == "__main__":
+    main()
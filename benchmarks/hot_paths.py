@@ -0,0 +1,381 @@
+"""Benchmark suite of the cog's hot paths.
+
+Runs without Discord: commands get a fake context, and the characters and
+items are stored in mongomock, or in a local MongoDB with --host. Results
+are saved as JSON, so runs on different commits can be compared with
+--baseline. Run from the directory that contains the cog:
+
+    python -m rpg.benchmarks.hot_paths --chars 1000,100000 --stacks 10,1000 \\
+        --output results.json --baseline previous.json
+
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import path
+from types import SimpleNamespace
+
+from mongoengine import connect, disconnect
+
+from ..config import config
+from ..data.character.attributes import race_templates
+from ..data.character.character import Character
+from ..data.character.inventory.inventory import stack_key
+from ..data.character.inventory.pages import InventoryPages
+from ..data.item.item import Item, Weapon
+from ..data.repository import ItemRepository
+from .item_search import synthetic_names
+
+CHUNK_SIZE = 10000
+
+
+class FakeMember:
+    """Member stand-in with the attributes used by the commands."""
+
+    def __init__(self, member_id: int):
+        self.id = member_id
+        self.bot = False
+        self.mention = f"<@{member_id}>"
+        self.display_name = str(member_id)
+
+
+class FakeContext:
+    """`commands.Context` stand-in that keeps the sent messages."""
+
+    def __init__(self, author: FakeMember, prefix: str = "!"):
+        self.author = author
+        self.prefix = prefix
+        self.sent = []
+
+    async def send(self, content: str = None, **kwargs):
+        self.sent.append((content, kwargs))
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=path.dirname(path.dirname(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(times: list) -> dict:
+    """Returns statistics of the call times.
+
+    Args:
+        times (list): Call times in seconds.
+
+    Returns:
+        dict: Number of calls and mean, p50, p95 and min time in microseconds.
+
+    """
+    times = sorted(value * 1e6 for value in times)
+    return {
+        "repeat": len(times),
+        "mean": sum(times) / len(times),
+        "p50": times[len(times) // 2],
+        "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+        "min": times[0],
+    }
+
+
+def timed(func) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def measure(func, repeat: int) -> dict:
+    """Calls the function `repeat` times.
+
+    Args:
+        func (Callable): Function without arguments.
+        repeat (int): Number of calls.
+
+    Returns:
+        dict: See `summarize`.
+
+    """
+    return summarize([timed(func) for _ in range(repeat)])
+
+
+def create_items(count: int) -> list:
+    """Stores a catalog of weapons and plain items.
+
+    Args:
+        count (int): Number of items.
+
+    Returns:
+        list: Stored items.
+
+    """
+    items = []
+    for item_id, name in enumerate(synthetic_names(count)):
+        if item_id % 2:
+            items.append(Item(item_id, name, "Предмет.", 10, "common"))
+        else:
+            items.append(
+                Weapon(
+                    item_id,
+                    name,
+                    "Оружие.",
+                    100,
+                    "common",
+                    attack_type="melee",
+                    hands=1,
+                    weapon_type="sword",
+                    material="iron",
+                    damage=10,
+                )
+            )
+    collection = Item._get_collection()
+    for start in range(0, count, CHUNK_SIZE):
+        collection.insert_many(
+            [item.to_mongo() for item in items[start : start + CHUNK_SIZE]]
+        )
+    return items
+
+
+def create_characters(count: int, templates: dict):
+    """Stores characters with empty inventories.
+
+    Args:
+        count (int): Number of characters.
+        templates (dict): Attribute templates by race.
+    """
+    races = list(templates)
+    collection = Character._get_collection()
+    for start in range(0, count, CHUNK_SIZE):
+        collection.insert_many(
+            [
+                Character.create(
+                    str(member_id),
+                    f"Персонаж {member_id}",
+                    races[member_id % len(races)],
+                    "male",
+                    "Персонаж для бенчмарка.",
+                    templates[races[member_id % len(races)]],
+                ).to_mongo()
+                for member_id in range(start, min(start + CHUNK_SIZE, count))
+            ]
+        )
+
+
+def fill_inventory(char: Character, items: list, stacks: int):
+    """Adds `stacks` different items to the inventory of the character."""
+    for item in items[:stacks]:
+        char.inventory.add_item(item, 1)
+    char.save()
+
+
+def character_cases(size: int, repeat: int, rng: random.Random, regen: bool) -> dict:
+    lookups = iter([str(rng.randrange(size)) for _ in range(repeat)])
+    results = {
+        "Character.get_char_by_id": measure(
+            lambda: Character.get_char_by_id(next(lookups)), repeat
+        )
+    }
+    if regen:
+        regen_times = []
+        for _ in range(max(1, repeat // 100)):
+            Character.objects.update(needs_regen=True)
+            regen_times.append(timed(Character.regenerate))
+        results["Character.regenerate"] = summarize(regen_times)
+    return results
+
+
+def inventory_cases(char: Character, items: list, stacks: int, repeat: int) -> dict:
+    spare = items[stacks : stacks + repeat] or items[:1]
+    weapon = next(item for item in items[:stacks] if isinstance(item, Weapon))
+    added = iter(spare * (repeat // len(spare) + 1))
+    removed = iter(spare * (repeat // len(spare) + 1))
+
+    def add():
+        char.inventory.add_item(next(added), 1)
+        char.save_updates()
+
+    def remove():
+        char.inventory.remove_item(next(removed), 1)
+        char.save_updates()
+
+    def equip():
+        char.equipment.equip_item(char.inventory.get_item(weapon, None, None))
+        char.save_updates()
+
+    def unequip():
+        char.equipment.unequip_slot("right_hand")
+        char.save_updates()
+
+    results = {
+        "Inventory.add_item": measure(add, repeat),
+        "Inventory.remove_item": measure(remove, repeat),
+    }
+    equip_times, unequip_times = [], []
+    for _ in range(repeat):
+        equip_times.append(timed(equip))
+        unequip_times.append(timed(unequip))
+    results["Equipment.equip_item"] = summarize(equip_times)
+    results["Equipment.unequip_slot"] = summarize(unequip_times)
+    return results
+
+
+def cog_cases(
+    cog_class: type,
+    loop: asyncio.AbstractEventLoop,
+    repository: ItemRepository,
+    char: Character,
+    items: list,
+    repeat: int,
+    rng: random.Random,
+) -> dict:
+    def render():
+        lookup = loop.run_until_complete(repository.lookup(char.inventory.item_ids()))
+        pages = InventoryPages(
+            char.inventory,
+            lookup,
+            list(config.inventory_categories),
+            measure=lambda stack, item: sum(
+                map(len, cog_class._inventory_field(stack, item))
+            ),
+        )
+        page = pages.first()
+        items = loop.run_until_complete(
+            repository.resolve(stack_key(stack)[0] for stack in page.entries)
+        )
+        cog_class._inventory_page(char, page, items)
+
+    cog = SimpleNamespace(items=repository, Red=None)
+    ctx = FakeContext(FakeMember(0))
+    names = iter([rng.choice(items).name for _ in range(repeat)])
+    return {
+        "RPG.inventory": measure(render, repeat),
+        "RPG.get_item_by_name": measure(
+            lambda: loop.run_until_complete(
+                cog_class.get_item_by_name(cog, ctx, next(names))
+            ),
+            repeat,
+        ),
+    }
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {
+        (result["case"], result["chars"], result["stacks"]): result["p50"]
+        for result in baseline["results"]
+    }
+    print(f"\nCompared with {baseline.get('commit', baseline_path)} (p50):")
+    for result in results:
+        before = previous.get((result["case"], result["chars"], result["stacks"]))
+        if before:
+            print(
+                f"{result['case']:>26} {result['chars']:>8} {result['stacks']:>6}: "
+                f"{result['p50'] / before:6.2f}x"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sizes = lambda value: [int(size) for size in value.split(",")]
+    parser.add_argument("--chars", type=sizes, default=[1000, 10000])
+    parser.add_argument("--stacks", type=sizes, default=[10, 100, 1000])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--host", default=None, help="MongoDB host. Mongomock if omitted."
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="Results of a previous run to compare with.")
+    args = parser.parse_args()
+    if args.items < max(args.stacks) + args.repeat:
+        parser.error("--items must exceed the largest --stacks plus --repeat")
+
+    if args.host:
+        connect("rpg_benchmark", host=args.host)
+    else:
+        import mongomock
+
+        connect("rpg_benchmark", mongo_client_class=mongomock.MongoClient)
+        # The regeneration tick is an update pipeline, which mongomock cannot run
+        print("Character.regenerate is measured only with --host")
+
+    rng = random.Random(args.seed)
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    templates = race_templates(config.race_stats)
+    results = []
+
+    def record(cases: dict, chars: int, stacks: int = 0):
+        for case, stats in cases.items():
+            results.append({"case": case, "chars": chars, "stacks": stacks, **stats})
+            print(
+                f"{case:>26} {chars:>8} {stacks:>6}: "
+                f"p50 {stats['p50']:10.1f} µs, p95 {stats['p95']:10.1f} µs"
+            )
+
+    try:
+        from ..RPG import RPG
+    except ImportError as e:
+        RPG = None
+        print(f"The cog cannot be imported ({e}), its cases are skipped")
+
+    Item.drop_collection()
+    items = create_items(args.items)
+    repository = ItemRepository(loop, executor, Item)
+    loop.run_until_complete(repository.load())
+    try:
+        for chars in args.chars:
+            Character.drop_collection()
+            started = time.perf_counter()
+            create_characters(chars, templates)
+            print(
+                f"{chars} characters created in {time.perf_counter() - started:.1f} s"
+            )
+            record(character_cases(chars, args.repeat, rng, bool(args.host)), chars)
+            for stacks in args.stacks:
+                char = Character.get_char_by_id(str(rng.randrange(chars)))
+                fill_inventory(char, items, stacks)
+                char = Character.get_char_by_id(char.member_id)
+                record(inventory_cases(char, items, stacks, args.repeat), chars, stacks)
+                if RPG is not None:
+                    cases = cog_cases(
+                        RPG, loop, repository, char, items, args.repeat, rng
+                    )
+                    record(cases, chars, stacks)
+    finally:
+        Character.drop_collection()
+        Item.drop_collection()
+        executor.shutdown()
+        loop.close()
+        disconnect()
+
+    report = {
+        "commit": commit(),
+        "created": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "backend": args.host or "mongomock",
+        "items": args.items,
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark of the item search index over a synthetic catalog.
+
+Run from the directory that contains the cog:
+
+    python -m rpg.benchmarks.item_search --size 100000
+
+"""
+import argparse
+import itertools as it
+import random
+import time
+
+from ..data.item.search import ItemSearchIndex
+
+ADJECTIVES = [
+    "железный",
+    "стальной",
+    "эльфийский",
+    "стеклянный",
+    "эбонитовый",
+    "двемерский",
+    "даэдрический",
+    "орочий",
+    "древний",
+    "зачарованный",
+    "ёмкий",
+]
+NOUNS = [
+    "меч",
+    "кинжал",
+    "лук",
+    "арбалет",
+    "топор",
+    "молот",
+    "щит",
+    "шлем",
+    "сапоги",
+    "перчатки",
+    "кираса",
+    "булава",
+]
+SUFFIXES = [
+    "ярости",
+    "льда",
+    "пламени",
+    "молний",
+    "стража",
+    "охотника",
+    "короля",
+    "теней",
+]
+
+
+def synthetic_names(size: int) -> list:
+    """Returns `size` unique item names.
+
+    Args:
+        size (int): Number of names.
+
+    Returns:
+        list: Item names.
+
+    """
+    combinations = it.cycle(it.product(ADJECTIVES, NOUNS, SUFFIXES))
+    return [
+        f"{adjective.title()} {noun} {suffix} {number}"
+        for number, (adjective, noun, suffix) in zip(range(size), combinations)
+    ]
+
+
+def typo(name: str, rng: random.Random) -> str:
+    """Returns the name with two swapped neighbouring letters."""
+    position = rng.randrange(1, len(name) - 1)
+    return name[: position - 1] + name[position] + name[position - 1] + name[position + 1 :]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = synthetic_names(args.size)
+
+    started = time.perf_counter()
+    index = ItemSearchIndex()
+    for item_id, name in enumerate(names):
+        index.add(item_id, name)
+    index.search("прогрев")
+    print(f"Build: {args.size} names in {time.perf_counter() - started:.2f} s")
+
+    samples = rng.sample(names, min(args.queries, len(names)))
+    cases = {
+        "exact": samples,
+        "prefix": [name[: len(name) // 2] for name in samples],
+        "word prefix": [name.split(" ")[1][:4] for name in samples],
+        "typo": [typo(name, rng) for name in samples],
+    }
+    for case, queries in cases.items():
+        started = time.perf_counter()
+        for query in queries:
+            index.best_matches(query)
+        elapsed = (time.perf_counter() - started) / len(queries)
+        print(f"{case:>12}: {elapsed * 1e6:9.1f} µs per query")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,178 @@
+from collections import namedtuple
+from collections.abc import Mapping
 from os import path
-
+from types import MappingProxyType
 import json
-from munch import Munch
+import keyword
 
 config_file_path = path.join(path.dirname(__file__), "config.json")
 
-with open(config_file_path) as config_file:
-    _config = json.load(config_file)
-    config = Munch.fromDict(_config)
+RaceStats = namedtuple("RaceStats", "main resists skills unarmed_damage")
+
+
+class Section(Mapping):
+    """Read-only config section.
+
+    Keys that are valid identifiers are stored in slots, so attribute access
+    is a plain slot lookup. All keys are available with the mapping interface.
+
+    """
+
+    __slots__ = ("_data",)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self._data)!r})"
+
+    def __getattr__(self, name):
+        # Called only for keys without a slot, such as keys added on reload
+        if not name.startswith("_"):
+            try:
+                return self._data[name]
+            except KeyError:
+                pass
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("Config is read-only")
+
+
+_section_classes = {}
+
+
+def _slot_names(keys: tuple) -> tuple:
+    return tuple(
+        key
+        for key in keys
+        if key.isidentifier() and not keyword.iskeyword(key) and not hasattr(Section, key)
+    )
+
+
+def _section_class(keys: tuple) -> type:
+    names = _slot_names(keys)
+    cls = _section_classes.get(names)
+    if cls is None:
+        cls = type("Section", (Section,), {"__slots__": names})
+        _section_classes[names] = cls
+    return cls
+
+
+def _fill(section: Section, data: dict):
+    object.__setattr__(section, "_data", MappingProxyType(data))
+    for name in type(section).__slots__:
+        if name in data:
+            object.__setattr__(section, name, data[name])
+        elif hasattr(section, name):
+            object.__delattr__(section, name)
+
+
+def freeze(value):
+    """Returns a read-only copy of the JSON value.
+
+    Args:
+        value: JSON value.
+
+    Returns:
+        Sections instead of dicts and tuples instead of lists.
+
+    """
+    if isinstance(value, dict):
+        data = {key: freeze(item) for key, item in value.items()}
+        section = object.__new__(_section_class(tuple(data)))
+        _fill(section, data)
+        return section
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+DERIVED = ("item_colours", "inventory_categories", "race_by_label", "race_stats")
+
+
+class Config(Section):
+    """Read-only snapshot of config.json with precomputed tables.
+
+    Like a section, the config stores its top-level keys in slots. They are
+    taken from the file when the config is created. Keys added to the file
+    later are still available as attributes, without the slot fast path.
+
+    Attributes:
+        item_colours (Mapping[str, int]): Embed colour by item rarity.
+        inventory_categories (Mapping[str, str]): Label by inventory category
+            in lower case, in display order.
+        race_by_label (Mapping[str, str]): Race by its humanized name.
+        race_stats (Mapping[str, RaceStats]): Initial attributes by race, with
+            values converted to the types of the attribute fields.
+
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, file_path: str = config_file_path):
+        with open(file_path) as config_file:
+            keys = tuple(key for key in json.load(config_file) if key not in DERIVED)
+        names = _slot_names(keys + DERIVED)
+        return object.__new__(type(cls.__name__, (cls,), {"__slots__": names}))
+
+    def __init__(self, file_path: str = config_file_path):
+        self._load(file_path)
+
+    def _load(self, file_path: str):
+        with open(file_path) as config_file:
+            data = freeze(json.load(config_file))
+        game, humanize = data["game"], data["humanize"]
+        derived = {
+            "item_colours": {
+                rarity: int(value, 0)
+                for rarity, value in game.item_settings.colors.items()
+            },
+            "inventory_categories": {
+                category.lower(): label
+                for category, label in humanize.inventory.inv_categories.items()
+            },
+            "race_by_label": {label: race for race, label in humanize.races.items()},
+            "race_stats": {
+                race: RaceStats(
+                    MappingProxyType({k: float(v) for k, v in stats.main.items()}),
+                    MappingProxyType({k: float(v) for k, v in stats.resists.items()}),
+                    MappingProxyType({k: float(v) for k, v in stats.skills.items()}),
+                    int(stats.unarmed_damage),
+                )
+                for race, stats in game.races.items()
+            },
+        }
+        for name, table in derived.items():
+            derived[name] = MappingProxyType(table)
+        _fill(self, {**data, **derived})
+
+    def reload(self, file_path: str = config_file_path):
+        """Reloads the config file.
+
+        Sections and tables are replaced, so code that keeps a reference to a
+        section, or has already copied values out of the config, sees the old
+        values.
+
+        Args:
+            file_path (str): Path to config.json.
+
+        Raises:
+            OSError: If the file cannot be read.
+            ValueError: If the file is not valid JSON.
+            KeyError: If a required section is missing.
+
+        """
+        self._load(file_path)
+
+
+config = Config()
@@ -0,0 +1,130 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """Least recently used cache with optional expiration of entries.
+
+    The cache is not thread-safe and is meant to be used from the event loop.
+
+    Attributes:
+        max_size (int): The maximum number of entries. The least recently used
+            entry is evicted when it is exceeded.
+        ttl (float): The lifetime of an entry in seconds. Entries never expire
+            if it is 0.
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+        evictions (int): Number of entries evicted because of the size limit
+            or expiration.
+
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not None
+
+    def _lookup(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires and expires < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value and marks it as recently used.
+
+        Args:
+            key (Hashable): Entry key.
+            default (Any): Value returned on a miss. Defaults to None.
+
+        Returns:
+            Any: Cached value or `default`.
+
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Stores the value and evicts the least recently used entries if needed.
+
+        Args:
+            key (Hashable): Entry key.
+            value (Any): Value to store.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Returns the cached value, creating and storing it on a miss.
+
+        Args:
+            key (Hashable): Entry key.
+            factory (Callable[[], Any]): Creates the value on a miss.
+
+        Returns:
+            Any: Cached or created value.
+
+        """
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Removes the entry.
+
+        Args:
+            key (Hashable): Entry key.
+            default (Any): Value returned if there is no entry. Defaults to None.
+
+        Returns:
+            Any: Removed value or `default`.
+
+        """
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        """Removes all entries."""
+        self._entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        """Returns cache counters.
+
+        Returns:
+            dict: Size, hits, misses and evictions.
+
+        """
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
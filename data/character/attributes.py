@@ -1,13 +1,56 @@
-from mongoengine import EmbeddedDocument, FloatField, DictField, IntField
+from datetime import datetime, timedelta
+from typing import Mapping
+
+from mongoengine import (
+    EmbeddedDocument,
+    FloatField,
+    DictField,
+    IntField,
+    DateTimeField,
+)
+
+REGEN_ATTRIBUTES = ("health", "stamina", "magicka")
+REGEN_INTERVAL = 5  # seconds
+
+
+def _regenerating(attribute: str) -> property:
+    """Returns a property which regenerates the attribute on access.
+
+    Setting the property writes back all regenerated values first, so that
+    regeneration of the other attributes is not lost.
+
+    Args:
+        attribute (str): Attribute name.
+
+    Returns:
+        property: Attribute property.
+
+    """
+
+    def getter(self) -> float:
+        return self.current_value(attribute)
+
+    def setter(self, value: float):
+        self.settle()
+        setattr(self, f"_{attribute}", value)
+
+    return property(getter, setter)
 
 
 class Attributes(EmbeddedDocument):
     """Character Attribute Class
 
+    Health, stamina and magicka are regenerated lazily. The database stores
+    their values at the time of `updated_at`, the current values are
+    calculated on access as if they were regenerated every `REGEN_INTERVAL`
+    seconds.
+
     Attributes:
         health (float): Character health. Equals 10 immediately after creating a character.
         stamina (float) Character stamina. Equals 10 immediately after creating a character.
         magicka (float) Character magicka. Equals 10 immediately after creating a character.
+        updated_at (datetime): The time when health, stamina and magicka were
+            last written.
         main (dict): The main dynamic attributes of the character.
         resists (dict): Character resistance to magic, elements, poisons and diseases.
         skills (dict): The level of skills of the character.
@@ -16,9 +59,10 @@ class Attributes(EmbeddedDocument):
 
     """
 
-    health = FloatField(default=10)
-    stamina = FloatField(default=10)
-    magicka = FloatField(default=10)
+    _health = FloatField(db_field="health", default=10)
+    _stamina = FloatField(db_field="stamina", default=10)
+    _magicka = FloatField(db_field="magicka", default=10)
+    updated_at = DateTimeField(default=None)
     main = DictField(FloatField())
     resists = DictField(FloatField(min_value=-90, max_value=90))
     skills = DictField(FloatField(min_value=0, max_value=100))
@@ -48,6 +92,81 @@ class Attributes(EmbeddedDocument):
         self.skills = skills
         self.unarmed_damage = unarmed_damage
 
+    health = _regenerating("health")
+    stamina = _regenerating("stamina")
+    magicka = _regenerating("magicka")
+
+    def _regen_ticks(self, now: datetime) -> int:
+        """Returns the number of regeneration intervals passed since `updated_at`.
+
+        Args:
+            now (datetime): Current UTC time.
+
+        Returns:
+            int: Number of whole intervals.
+
+        """
+        if self.updated_at is None:
+            return 0
+        elapsed = (now - self.updated_at).total_seconds()
+        return max(int(elapsed // REGEN_INTERVAL), 0)
+
+    def current_value(self, attribute: str, now: datetime = None) -> float:
+        """Returns the regenerated value of health, stamina or magicka.
+
+        The result is the same as if `Attributes.mod_value` was applied with
+        the regeneration amount once per every passed interval.
+
+        Args:
+            attribute (str): Attribute name. May be health, stamina or magicka.
+            now (:obj:`datetime`, optional): Current UTC time. Defaults to now.
+
+        Returns:
+            float: Current attribute value.
+
+        """
+        value = getattr(self, f"_{attribute}")
+        ticks = self._regen_ticks(now or datetime.utcnow())
+        if not ticks:
+            return value
+        try:
+            total = self.get_total_value(attribute)
+            amount = (
+                self.main[f"{attribute}_max"]
+                * self.main[f"{attribute}_regen"]
+                * REGEN_INTERVAL
+                / 100
+            )
+        except KeyError:
+            return value
+        if value + amount > total:
+            return total
+        if value + amount < 1:
+            # The first interval resets the value and no further one can raise it
+            return 0 if amount < 1 else min(amount * (ticks - 1), total)
+        return min(value + amount * ticks, total)
+
+    def settle(self, now: datetime = None):
+        """Writes the regenerated health, stamina and magicka back.
+
+        `updated_at` is moved forward by whole intervals only, so the progress
+        of the current interval is kept.
+
+        Args:
+            now (:obj:`datetime`, optional): Current UTC time. Defaults to now.
+        """
+        now = now or datetime.utcnow()
+        ticks = self._regen_ticks(now)
+        if self.updated_at is None:
+            self.updated_at = now
+        elif ticks:
+            values = [self.current_value(attr, now) for attr in REGEN_ATTRIBUTES]
+            for attribute, value in zip(REGEN_ATTRIBUTES, values):
+                setattr(self, f"_{attribute}", value)
+            self.updated_at = self.updated_at + timedelta(
+                seconds=ticks * REGEN_INTERVAL
+            )
+
     def get_total_value(self, attribute: str) -> int:
         """Returns the maximum attribute value, including all bonuses.
 
@@ -106,13 +225,99 @@ class Attributes(EmbeddedDocument):
         else:
             raise AttributeNotFound
 
+    def needs_regen(self) -> bool:
+        """Returns whether any of health, stamina and magicka can still regenerate.
+
+        Returns:
+            bool: True if an attribute is below its maximum and regenerates.
+
+        """
+        for attribute in REGEN_ATTRIBUTES:
+            if (
+                self.main.get(f"{attribute}_regen", 0) > 0
+                and getattr(self, attribute) < self.get_total_value(attribute)
+            ):
+                return True
+        return False
+
     def restore_values(self):
         """ Restores Health, Stamina and Magicka """
+        self.updated_at = datetime.utcnow()
         self.health = self.main["health_max"]
         self.stamina = self.main["stamina_max"]
         self.magicka = self.main["magicka_max"]
 
 
+class AttributesTemplate:
+    """Prevalidated initial attributes of a race.
+
+    The attributes are restored, validated and converted to their stored form
+    once. Creating attributes from the template only copies this small
+    structure, no field conversion or validation is performed.
+
+    Attributes:
+        needs_regen (bool): `Attributes.needs_regen` of the created attributes.
+
+    """
+
+    __slots__ = ("_son", "needs_regen")
+
+    def __init__(
+        self, main: Mapping, resists: Mapping, skills: Mapping, unarmed_damage: int
+    ):
+        """Template constructor
+
+        Args:
+            main (Mapping): The main dynamic attributes of the race.
+            resists (Mapping): Resistances of the race.
+            skills (Mapping): Skill levels of the race.
+            unarmed_damage (int): Unarmed damage of the race.
+
+        Raises:
+            ValidationError: If the values do not match the attribute fields.
+
+        """
+        attributes = Attributes(dict(main), dict(resists), dict(skills), unarmed_damage)
+        attributes.restore_values()
+        attributes.validate()
+        self.needs_regen = attributes.needs_regen()
+        son = attributes.to_mongo().to_dict()
+        son.pop("updated_at", None)
+        self._son = son
+
+    def create(self) -> Attributes:
+        """Returns new attributes with restored health, stamina and magicka.
+
+        Returns:
+            Attributes: Attributes of a new character.
+
+        """
+        son = self._son
+        return Attributes._from_son(
+            {
+                **son,
+                "main": dict(son["main"]),
+                "resists": dict(son["resists"]),
+                "skills": dict(son["skills"]),
+                "updated_at": datetime.utcnow(),
+            }
+        )
+
+
+def race_templates(race_stats: Mapping) -> dict:
+    """Prepares attribute templates of all races.
+
+    Args:
+        race_stats (Mapping): Initial attributes by race, see
+            `Config.race_stats`.
+
+    Returns:
+        dict: `AttributesTemplate` by race.
+
+    """
+    return {race: AttributesTemplate(*stats) for race, stats in race_stats.items()}
+
+
 class AttributeNotFound(Exception):
     """Raises if the attribute is not found."""
 
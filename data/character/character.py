@@ -1,17 +1,42 @@
+import zlib
+from datetime import datetime
+from typing import Union
+
+from pymongo import UpdateOne
 from mongoengine import (
     Document,
     StringField,
     IntField,
     FloatField,
     URLField,
+    BooleanField,
     EmbeddedDocumentField,
 )
 
 from .inventory.equipment import Equipment
-from .attributes import Attributes
+from .attributes import Attributes, AttributesTemplate
 from .inventory.inventory import Inventory
+from .regeneration import RegenReport, regenerate
 from ...config import config
 
+REGEN_BUCKETS = 1024
+
+
+def regen_bucket(member_id: str) -> int:
+    """Returns the regeneration bucket of the member.
+
+    Buckets split the characters between regeneration workers, see
+    `regen_worker`. The hash is stable between processes.
+
+    Args:
+        member_id (str): Member ID.
+
+    Returns:
+        int: Bucket from 0 to `REGEN_BUCKETS` - 1.
+
+    """
+    return zlib.crc32(member_id.encode()) % REGEN_BUCKETS
+
 
 class Character(Document):
     """Character class
@@ -32,6 +57,9 @@ class Character(Document):
         inventory (Inventory): Character inventory.
         attributes (Attributes): Character attributes.
         equipment (Equipment): Character equipment.
+        needs_regen (bool): Whether health, stamina or magicka of the character
+            is below the maximum. Only these characters are regenerated.
+        regen_bucket (int): Hash bucket of the member ID, see `regen_bucket`.
     """
 
     member_id = StringField(primary_key=True)
@@ -46,6 +74,29 @@ class Character(Document):
     inventory = EmbeddedDocumentField(Inventory)
     attributes = EmbeddedDocumentField(Attributes)
     equipment = EmbeddedDocumentField(Equipment)
+    needs_regen = BooleanField(default=False)
+    regen_bucket = IntField(min_value=0, max_value=REGEN_BUCKETS - 1)
+
+    meta = {
+        "indexes": [
+            {
+                "fields": ["needs_regen", "regen_bucket", "member_id"],
+                "partialFilterExpression": {"needs_regen": True},
+            }
+        ]
+    }
+
+    # Fields whose changes can be saved with the recorded updates
+    PARTIAL_FIELDS = (
+        "inventory",
+        "equipment",
+        "attributes.armor_rating",
+        "attributes.health",
+        "attributes.stamina",
+        "attributes.magicka",
+        "attributes.updated_at",
+        "needs_regen",
+    )
 
     def __init__(
         self,
@@ -80,6 +131,166 @@ class Character(Document):
         self.inventory = inventory
         self.attributes = attributes
         self.equipment = equipment
+        if member_id is not None:
+            self.regen_bucket = regen_bucket(member_id)
+
+    @classmethod
+    def create(
+        cls,
+        member_id: str,
+        name: str,
+        race: str,
+        sex: str,
+        desc: str,
+        template: AttributesTemplate,
+    ):
+        """Creates a new character with the attributes of the race template.
+
+        Only the fields entered by the member are validated here. The rest of
+        the character comes from the prevalidated template, so the first save
+        skips the full validation and is a plain insert.
+
+        Args:
+            member_id (str): Member ID.
+            name (str): Character name.
+            race (str): Character race.
+            sex (str): Character sex.
+            desc (str): Character description.
+            template (AttributesTemplate): Attributes template of the race.
+
+        Returns:
+            Character: New character that is not saved yet.
+
+        Raises:
+            ValidationError: If the entered fields are not valid.
+
+        """
+        char = cls(
+            member_id,
+            name,
+            race,
+            sex,
+            desc,
+            Inventory(),
+            template.create(),
+            Equipment(),
+        )
+        for field in ("member_id", "name", "race", "sex", "desc"):
+            cls._fields[field]._validate(getattr(char, field))
+        char.needs_regen = template.needs_regen
+        char.__dict__["_prevalidated"] = True
+        return char
+
+    def save(self, *args, **kwargs):
+        """Saves the whole character and drops the recorded updates."""
+        self.__dict__.pop("_pending_updates", None)
+        self.__dict__.pop("_save_whole", None)
+        if self.__dict__.pop("_prevalidated", False):
+            kwargs.setdefault("validate", False)
+            kwargs.setdefault("force_insert", True)
+        return super().save(*args, **kwargs)
+
+    def record_update(self, update: Union[dict, list], query: dict = None):
+        """Records an atomic update that mirrors a change of the character.
+
+        Recorded updates are applied by `save_updates` instead of rewriting the
+        whole document.
+
+        Args:
+            update (Union[dict, list]): Update document or update pipeline.
+            query (:obj:`dict`, optional): Additional filter of the update.
+        """
+        pending = self.__dict__.setdefault("_pending_updates", [])
+        pending.append(({"_id": self.pk, **(query or {})}, update))
+
+    def record_vitals(self):
+        """Records the update of health, stamina and magicka.
+
+        `needs_regen` is updated as well, since it depends on these values.
+        """
+        attributes = self.attributes
+        attributes.settle()
+        self.needs_regen = attributes.needs_regen()
+        self.record_update(
+            {
+                "$set": {
+                    "attributes.health": attributes._health,
+                    "attributes.stamina": attributes._stamina,
+                    "attributes.magicka": attributes._magicka,
+                    "attributes.updated_at": attributes.updated_at,
+                    "needs_regen": self.needs_regen,
+                }
+            }
+        )
+
+    def _take_updates(self):
+        pending = self.__dict__.pop("_pending_updates", [])
+        if self.__dict__.get("_save_whole"):
+            return None
+        paths = {
+            path.split(".$", 1)[0]
+            for _, update in pending
+            for stage in (update if isinstance(update, list) else [update])
+            for fields in stage.values()
+            for path in fields
+        }
+        changed = self._get_changed_fields()
+        if (
+            self._created
+            or not pending
+            or not all(
+                field.startswith(self.PARTIAL_FIELDS)
+                and any(field == p or field.startswith(p + ".") for p in paths)
+                for field in changed
+            )
+        ):
+            return None
+        return [UpdateOne(query, update) for query, update in pending]
+
+    def save_updates(self):
+        """Saves the changes of the character with the recorded updates.
+
+        If the character is new, or some of the changed fields are not covered
+        by the recorded updates, the whole character is saved instead.
+        """
+        self.save_all([self])
+
+    @classmethod
+    def save_all(cls, chars: list):
+        """Saves the changes of several characters.
+
+        The recorded updates of all characters are written with a single
+        request. Characters that cannot be saved with their recorded updates
+        are saved whole, see `Character.save_updates`. If the save fails, the
+        recorded updates are lost, so the characters are saved whole next
+        time.
+
+        Args:
+            chars (list): Characters to save.
+        """
+        requests = []
+        partial = []
+        try:
+            for char in chars:
+                updates = char._take_updates()
+                if updates is None:
+                    char.save()
+                else:
+                    requests.extend(updates)
+                    partial.append(char)
+            if requests:
+                cls._get_collection().bulk_write(requests, ordered=True)
+        except Exception:
+            for char in chars:
+                char.__dict__["_save_whole"] = True
+            raise
+        for char in partial:
+            char._clear_changed_fields()
+
+    def clean(self):
+        """Updates `needs_regen` before the character is saved."""
+        if self.attributes:
+            self.needs_regen = self.attributes.needs_regen()
 
     @classmethod
     def is_member_registered(cls, member_id: str) -> bool:
@@ -116,6 +327,75 @@ class Character(Document):
             raise CharacterNotFound
         return chars.first()
 
+    @classmethod
+    def regenerate(cls) -> RegenReport:
+        """Writes back regenerated health, stamina and magicka of the characters.
+
+        Only the characters marked with `needs_regen` are updated. The update is
+        performed on the database side with a single request.
+
+        Returns:
+            RegenReport: Regeneration report.
+
+        """
+        return regenerate(cls._get_collection())
+
+    @classmethod
+    def mark_regen_candidates(cls) -> int:
+        """Marks the characters saved before `needs_regen` was introduced.
+
+        Such characters are regenerated once, after which the flag reflects
+        their actual state.
+
+        Returns:
+            int: The number of marked characters.
+
+        """
+        return cls.objects(needs_regen__exists=False).update(needs_regen=True)
+
+    @classmethod
+    def stamp_regen_start(cls) -> int:
+        """Starts regeneration of the characters saved without `updated_at`.
+
+        Regeneration is counted from `updated_at`, so such characters would
+        never regenerate. Their regeneration starts now.
+
+        Returns:
+            int: The number of updated characters.
+
+        """
+        return cls.objects(attributes__exists=True, attributes__updated_at=None).update(
+            set__attributes__updated_at=datetime.utcnow()
+        )
+
+    @classmethod
+    def assign_regen_buckets(cls, batch_size: int = 1000) -> int:
+        """Sets `regen_bucket` of the characters saved without it.
+
+        Args:
+            batch_size (int): Number of characters updated with one request.
+
+        Returns:
+            int: The number of updated characters.
+
+        """
+        collection = cls._get_collection()
+        updated = 0
+        while True:
+            batch = [
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {"regen_bucket": regen_bucket(doc["_id"])}},
+                )
+                for doc in collection.find(
+                    {"regen_bucket": {"$exists": False}}, {"_id": 1}
+                ).limit(batch_size)
+            ]
+            if not batch:
+                return updated
+            collection.bulk_write(batch, ordered=False)
+            updated += len(batch)
+
 
 class CharacterNotFound(Exception):
     """Raises if the member is not registered."""
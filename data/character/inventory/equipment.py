@@ -1,7 +1,7 @@
 from mongoengine import EmbeddedDocumentField, EmbeddedDocument
 
 from ...item.item import Item
-from .inventory import ItemNotFoundInInventory
+from .inventory import ItemNotFoundInInventory, item_key
 from .item import ItemInstance, InventoryItem, inv_item_to_instance
 
 
@@ -60,11 +60,43 @@ class Equipment(EmbeddedDocument):
         self.gauntlets = gauntlets
         self.boots = boots
 
+    def _record(self, slot: str = None, armor: bool = False):
+        """Records an atomic update of the slot for the owning character.
+
+        Args:
+            slot (:obj:`str`, optional): Changed slot.
+            armor (bool): Whether the armor rating of the character was changed.
+        """
+        char = getattr(self, "_instance", None)
+        if char is None or not hasattr(char, "record_update"):
+            return
+        if slot:
+            item = getattr(self, slot)
+            if item:
+                char.record_update({"$set": {f"equipment.{slot}": item.to_mongo()}})
+            else:
+                char.record_update({"$unset": {f"equipment.{slot}": ""}})
+        if armor:
+            rating = char.attributes.armor_rating
+            char.record_update({"$set": {"attributes.armor_rating": rating}})
+
     def to_dict(self) -> dict:
         slots = list(dict(self.to_mongo()).keys())
         items = [getattr(self, slot) for slot in slots]
         return dict(zip(slots, items))
 
+    def item_ids(self) -> dict:
+        """Returns the IDs of the equipped items without dereferencing them.
+
+        Returns:
+            dict: Item ID by slot. Empty slots are skipped.
+
+        """
+        return {
+            slot: item_key(instance._data.get("item"))[0]
+            for slot, instance in self.to_dict().items()
+        }
+
     def unequip_item(self, item: Item):
         """Unequips the item.
 
@@ -101,9 +133,11 @@ class Equipment(EmbeddedDocument):
         item = getattr(self, slot)
         if item:
             inventory.add_item(item.item, 1, item.maker, item.temper)
-            if hasattr(item.item, "armor"):
+            armor = hasattr(item.item, "armor")
+            if armor:
                 attributes.mod_value("armor_rating", item.item.armor)
             setattr(self, slot, None)
+            self._record(slot, armor)
 
     def equip_item(self, item: InventoryItem):
         """Equips the item.
@@ -134,15 +168,18 @@ class Equipment(EmbeddedDocument):
                     else:
                         if weapon_right.hands == 1:
                             self.left_hand = right_hand
+                            self._record("left_hand")
                         else:
                             self.unequip_slot("right_hand")
                 self.right_hand = item_instance
+                self._record("right_hand")
             elif category == "Armor":
                 slot = item_instance.item.slot
                 if getattr(self, slot):
                     self.unequip_slot(slot)
                 setattr(self, slot, item_instance)
                 attributes.mod_value("armor_rating", item_instance.item.armor)
+                self._record(slot, armor=True)
             else:
                 raise ItemIsNotEquippable
             inventory.remove_item(
@@ -1,18 +1,175 @@
-from mongoengine import EmbeddedDocument, EmbeddedDocumentListField, DoesNotExist
-from mongoengine.queryset.base import BaseQuerySet
+from typing import List
+
+from bson import DBRef
+from mongoengine import Document, EmbeddedDocument, EmbeddedDocumentListField
 
 from .item import InventoryItem
 from ...item.item import Item
 
 
+def item_key(item, maker: str = None, temper: int = None) -> tuple:
+    """Returns the key of an inventory stack.
+
+    Item references are not dereferenced, so building a key never queries
+    the database.
+
+    Args:
+        item: Item object, DBRef or item ID.
+        maker (:obj:`str`, optional): Name of the maker of the item.
+        temper (:obj:`int`, optional): Item tempering.
+
+    Returns:
+        tuple: (item_id, maker, temper)
+
+    """
+    if isinstance(item, DBRef):
+        item = item.id
+    elif isinstance(item, Document):
+        item = item.pk
+    return item, maker, temper
+
+
+def stack_key(stack: InventoryItem) -> tuple:
+    """Returns the key of an inventory item.
+
+    Args:
+        stack (InventoryItem): Inventory item.
+
+    Returns:
+        tuple: (item_id, maker, temper)
+
+    """
+    return item_key(stack._data.get("item"), stack.maker, stack.temper)
+
+
 class Inventory(EmbeddedDocument):
-    """Inventory class"""
+    """Inventory class
+
+    Stacks of every category are indexed by `(item_id, maker, temper)`. The
+    index is built on first access and kept in sync by `add_item` and
+    `remove_item`, so stack lookup and increment take constant time. Removal
+    keeps the order of the stacks, the same as in the database.
+
+    Changes made by `add_item` and `remove_item` are also recorded as atomic
+    updates of the owning character, see `Character.record_update`.
+    """
 
     weapon = EmbeddedDocumentListField(InventoryItem)
     armor = EmbeddedDocumentListField(InventoryItem)
     item = EmbeddedDocumentListField(InventoryItem)
 
-    def get_items(self, item: Item) -> BaseQuerySet:
+    CATEGORIES = ("weapon", "armor", "item")
+
+    def _slots(self, category: str) -> dict:
+        """Returns the index of stack positions of the category.
+
+        The index is rebuilt if the list was changed bypassing the index.
+
+        Args:
+            category (str): Category name in lower case.
+
+        Returns:
+            dict: Stack position by stack key.
+
+        """
+        stacks = getattr(self, category)
+        indexes = self.__dict__.setdefault("_slot_indexes", {})
+        slots = indexes.get(category)
+        if slots is None or len(slots) != len(stacks):
+            slots = {stack_key(stack): i for i, stack in enumerate(stacks)}
+            indexes[category] = slots
+        return slots
+
+    def _find(self, category: str, key: tuple):
+        stacks = getattr(self, category)
+        position = self._slots(category).get(key)
+        if position is not None and stack_key(stacks[position]) != key:
+            # The list was reordered bypassing the index
+            self.__dict__["_slot_indexes"].pop(category)
+            position = self._slots(category).get(key)
+        return position
+
+    def _record(self, category: str, stack: InventoryItem, count: int):
+        """Records an atomic update of the stack for the owning character.
+
+        The update is a single pipeline that changes the count of the stored
+        stack with the same key, wherever it is. A missing stack is appended
+        when items are added, and a stack left with less than one item is
+        removed in place, so the stored order matches the local one.
+
+        Args:
+            category (str): Category name in lower case.
+            stack (InventoryItem): Changed stack.
+            count (int): Change of the number of items.
+        """
+        char = getattr(self, "_instance", None)
+        if char is None or not hasattr(char, "record_update"):
+            return
+        son = stack.to_mongo()
+        matches = {
+            "$and": [
+                {"$eq": [{"$ifNull": [f"$$this.{name}", None]}, {"$literal": value}]}
+                for name, value in (
+                    (name, son.get(name)) for name in ("item", "maker", "temper")
+                )
+            ]
+        }
+        field = f"inventory.{category}"
+        stacks = {"$ifNull": [f"${field}", []]}
+        changed = {
+            "$map": {
+                "input": stacks,
+                "in": {
+                    "$cond": [
+                        matches,
+                        {
+                            "$mergeObjects": [
+                                "$$this",
+                                {"count": {"$add": ["$$this.count", count]}},
+                            ]
+                        },
+                        "$$this",
+                    ]
+                },
+            }
+        }
+        if count > 0:
+            son["count"] = count
+            value = {
+                "$cond": [
+                    {"$size": {"$filter": {"input": stacks, "cond": matches}}},
+                    changed,
+                    {"$concatArrays": [stacks, [{"$literal": son}]]},
+                ]
+            }
+        else:
+            value = {
+                "$filter": {
+                    "input": changed,
+                    "cond": {
+                        "$or": [{"$not": [matches]}, {"$gte": ["$$this.count", 1]}]
+                    },
+                }
+            }
+        char.record_update([{"$set": {field: value}}])
+
+    def item_ids(self) -> set:
+        """Returns the IDs of all items in the inventory.
+
+        Item references are not dereferenced, so the items can be fetched
+        afterwards in one batch.
+
+        Returns:
+            set: Item IDs.
+
+        """
+        return {
+            stack_key(stack)[0]
+            for category in self.CATEGORIES
+            for stack in getattr(self, category)
+        }
+
+    def get_items(self, item: Item) -> List[InventoryItem]:
         """Returns a list of items that match this item object from inventory.
 
         Args:
@@ -27,8 +184,14 @@ class Inventory(EmbeddedDocument):
         """
 
         category = item.category.lower()
-        items = getattr(self, category, None).filter(item=item)
-        if not bool(items):
+        stacks = getattr(self, category)
+        item_id = item_key(item)[0]
+        items = [
+            stacks[position]
+            for key, position in self._slots(category).items()
+            if key[0] == item_id
+        ]
+        if not items:
             raise ItemNotFoundInInventory
         return items
 
@@ -49,12 +212,10 @@ class Inventory(EmbeddedDocument):
         """
 
         category = item.category.lower()
-        items = getattr(self, category, None)
-        try:
-            item = items.get(item=item, maker=maker, temper=temper)
-        except DoesNotExist:
+        position = self._find(category, item_key(item, maker, temper))
+        if position is None:
             raise ItemNotFoundInInventory
-        return item
+        return getattr(self, category)[position]
 
     def add_item(self, item: Item, count: int, maker: str = None, temper: int = None):
         """Adds item to inventory.
@@ -70,14 +231,16 @@ class Inventory(EmbeddedDocument):
                 to None.
             temper (:obj:`int`, optional): Item tempering. Defaults to None.
         """
+        category = item.category.lower()
         try:
             _item = self.get_item(item, maker, temper)
             _item.count += count
         except ItemNotFoundInInventory:
-            category = item.category.lower()
-            getattr(self, category).create(
-                item=item, count=count, maker=maker, temper=temper
-            )
+            stacks = getattr(self, category)
+            slots = self._slots(category)
+            _item = stacks.create(item=item, count=count, maker=maker, temper=temper)
+            slots[item_key(item, maker, temper)] = len(stacks) - 1
+        self._record(category, _item, count)
 
     def remove_item(
         self, item: Item, count: int, maker: str = None, temper: int = None
@@ -85,7 +248,8 @@ class Inventory(EmbeddedDocument):
         """Removes item from inventory.
 
         The method reduces the number of items. If after this, the number of
-        this item is less than 1, then it will be deleted.
+        this item is less than 1, then it will be deleted. The following
+        stacks keep their order.
 
         Args:
             item (Item): The item to remove from inventory.
@@ -96,12 +260,19 @@ class Inventory(EmbeddedDocument):
 
         """
 
-        _item = self.get_item(item, maker, temper)
+        category = item.category.lower()
+        key = item_key(item, maker, temper)
+        position = self._find(category, key)
+        if position is None:
+            raise ItemNotFoundInInventory
+        stacks = getattr(self, category)
+        _item = stacks[position]
         _item.count -= count
+        self._record(category, _item, -count)
         if _item.count < 1:
-            getattr(self, item.category.lower()).filter(
-                item=item, maker=maker, temper=temper
-            ).delete()
+            stacks.pop(position)
+            # Positions of the following stacks have shifted
+            self.__dict__["_slot_indexes"].pop(category, None)
 
     def is_inventory_empty(self) -> bool:
         """Returns whether there are items in the inventory.
@@ -0,0 +1,153 @@
+import heapq
+from collections import namedtuple
+from operator import itemgetter
+from typing import Callable, Iterator, List, Optional
+
+from .inventory import Inventory, stack_key
+from ...item.item import Item
+
+# Discord allows 25 fields and 6000 characters per embed. The rest of the
+# length is left to the title, description, footer and author.
+MAX_FIELDS = 25
+MAX_LENGTH = 5000
+
+InventoryPage = namedtuple("InventoryPage", "category number total size entries")
+InventoryPage.__doc__ = """Page of the inventory.
+
+Attributes:
+    category (str): Category name in lower case.
+    number (int): Page number, starting from 1.
+    total (int): Number of pages.
+    size (int): Number of stacks in the category.
+    entries (list): Inventory items of the page. Their items are not
+        resolved.
+
+"""
+
+_sort_key = itemgetter(0)
+
+
+class InventoryPages:
+    """Lazy pages of the inventory sorted by item name.
+
+    Pages are split by the number of stacks, so no page boundaries are
+    computed up front. Only the sort keys of the first and the last stack of
+    the shown page are kept. Each turn selects the stacks of the next or the
+    previous page from a generator over the category with a bounded heap, so
+    an open menu holds neither the items nor the stacks of the inventory.
+    The length of the page text is limited when the page is rendered.
+
+    Attributes:
+        inventory (Inventory): Inventory to show.
+        lookup (Callable[[int], Optional[Item]]): Returns the item by ID, or
+            None if it is unknown. Stacks of unknown items are skipped. The
+            items are used for sorting only and are not kept.
+        categories (list): Category names in lower case, in display order.
+            Empty categories are skipped.
+        per_page (int): The maximum number of stacks on a page.
+
+    """
+
+    def __init__(
+        self,
+        inventory: Inventory,
+        lookup: Callable[[int], Optional[Item]],
+        categories: List[str],
+        per_page: int = MAX_FIELDS,
+    ):
+        self.inventory = inventory
+        self.lookup = lookup
+        self.per_page = per_page
+        self._sizes = {}
+        for category in categories:
+            size = sum(1 for _ in self._entries(category))
+            if size:
+                self._sizes[category] = size
+        self.categories = list(self._sizes)
+        self._category = 0
+        self._page = 0
+        self._first = self._last = None
+
+    def __len__(self) -> int:
+        return sum(map(self._pages, self.categories))
+
+    def _pages(self, category: str) -> int:
+        return -(-self._sizes[category] // self.per_page)
+
+    def _entries(self, category: str) -> Iterator[tuple]:
+        for stack in getattr(self.inventory, category):
+            if stack.count < 1:
+                continue
+            item_id = stack_key(stack)[0]
+            item = self.lookup(item_id)
+            if item is None:
+                continue
+            key = (item.name, item_id, stack.maker or "", stack.temper or 0)
+            yield key, stack
+
+    def _select(
+        self, category_index: int, page: int, after: tuple = None, before: tuple = None
+    ) -> InventoryPage:
+        category = self.categories[category_index]
+        entries = self._entries(category)
+        if after is not None:
+            entries = (entry for entry in entries if entry[0] > after)
+            selected = heapq.nsmallest(self.per_page, entries, key=_sort_key)
+        elif before is not None:
+            entries = (entry for entry in entries if entry[0] < before)
+            selected = heapq.nlargest(self.per_page, entries, key=_sort_key)[::-1]
+        elif page:
+            # The last page holds the rest of the stacks
+            count = self._sizes[category] - page * self.per_page
+            selected = heapq.nlargest(count, entries, key=_sort_key)[::-1]
+        else:
+            selected = heapq.nsmallest(self.per_page, entries, key=_sort_key)
+        self._category, self._page = category_index, page
+        if selected:
+            self._first, self._last = selected[0][0], selected[-1][0]
+        else:
+            # The inventory has changed since the menu was opened
+            self._first = self._last = None
+        number = sum(map(self._pages, self.categories[:category_index]))
+        return InventoryPage(
+            category,
+            number + page + 1,
+            len(self),
+            self._sizes[category],
+            [stack for _, stack in selected],
+        )
+
+    def first(self) -> InventoryPage:
+        """Returns the first page.
+
+        Returns:
+            InventoryPage: The first page, or None if the inventory is empty.
+
+        """
+        if not self.categories:
+            return None
+        return self._select(0, 0)
+
+    def next(self) -> InventoryPage:
+        """Turns to the next page. The last page is followed by the first one.
+
+        Returns:
+            InventoryPage: The next page.
+
+        """
+        category = self.categories[self._category]
+        if self._last is not None and self._page + 1 < self._pages(category):
+            return self._select(self._category, self._page + 1, after=self._last)
+        return self._select((self._category + 1) % len(self.categories), 0)
+
+    def previous(self) -> InventoryPage:
+        """Turns to the previous page. The first page is preceded by the last one.
+
+        Returns:
+            InventoryPage: The previous page.
+
+        """
+        if self._first is not None and self._page > 0:
+            return self._select(self._category, self._page - 1, before=self._first)
+        index = (self._category - 1) % len(self.categories)
+        return self._select(index, self._pages(self.categories[index]) - 1)
@@ -0,0 +1,289 @@
+"""Standalone regeneration worker.
+
+Writes back regenerated health, stamina and magicka of the characters
+outside the bot process. Characters are split into shards by the hash
+bucket of the member ID. Each process holds the lease of one shard and
+updates its characters in batches, so the throughput grows with the number
+of processes up to the number of shards. Run from the directory that
+contains the cog:
+
+    python -m rpg.data.character.regen_worker --processes 4
+
+"""
+import argparse
+import logging
+import multiprocessing
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from mongoengine import connect
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+from ...config import config
+from .attributes import REGEN_INTERVAL
+from .character import REGEN_BUCKETS, Character
+from .regeneration import RegenReport, regenerate
+
+log = logging.getLogger("red.rpg.regen")
+
+LEASES_COLLECTION = "regen_leases"
+
+
+class ShardLease:
+    """Lease of a shard in the leases collection.
+
+    A lease is a document with the owner and the expiration time. A shard is
+    free when its lease has expired, so the shard of a dead worker is taken
+    over by another one after `ttl`. Clocks of the workers are assumed to be
+    in sync.
+
+    Attributes:
+        owner (str): Unique ID of the worker.
+        shards (int): Total number of shards.
+        ttl (float): Lease time in seconds.
+        shard (int): The held shard or None.
+
+    """
+
+    def __init__(self, collection: Collection, owner: str, shards: int, ttl: float):
+        self.collection = collection
+        self.owner = owner
+        self.shards = shards
+        self.ttl = ttl
+        self.shard = None
+
+    def _lease_id(self, shard: int) -> str:
+        return f"{self.shards}:{shard}"
+
+    def _take(self, shard: int) -> bool:
+        now = datetime.utcnow()
+        try:
+            lease = self.collection.find_one_and_update(
+                {
+                    "_id": self._lease_id(shard),
+                    "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}],
+                },
+                {
+                    "$set": {
+                        "owner": self.owner,
+                        "expires_at": now + timedelta(seconds=self.ttl),
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held by another worker
+            return False
+        return lease is not None and lease["owner"] == self.owner
+
+    def acquire(self, first: int = 0) -> Optional[int]:
+        """Takes the first free shard.
+
+        Args:
+            first (int): The shard to try first. The rest are tried in order.
+
+        Returns:
+            Optional[int]: The taken shard or None if all shards are held.
+
+        """
+        for offset in range(self.shards):
+            shard = (first + offset) % self.shards
+            if self._take(shard):
+                self.shard = shard
+                return shard
+        return None
+
+    def renew(self) -> bool:
+        """Extends the held lease.
+
+        Returns:
+            bool: False if the lease was lost.
+
+        """
+        if self.shard is None:
+            return False
+        if not self._take(self.shard):
+            self.shard = None
+            return False
+        return True
+
+    def release(self):
+        """Gives up the held lease."""
+        if self.shard is not None:
+            self.collection.delete_one(
+                {"_id": self._lease_id(self.shard), "owner": self.owner}
+            )
+            self.shard = None
+
+
+class RegenWorker:
+    """Regenerates the characters of a shard in batches.
+
+    Attributes:
+        lease (ShardLease): Lease of the shard.
+        batch_size (int): Number of characters updated with one request.
+
+    """
+
+    def __init__(self, collection: Collection, lease: ShardLease, batch_size: int):
+        self.collection = collection
+        self.lease = lease
+        self.batch_size = batch_size
+
+    def shard_query(self, shard: int) -> dict:
+        """Returns the filter of the characters of the shard to regenerate.
+
+        Args:
+            shard (int): Shard number.
+
+        Returns:
+            dict: Query that uses the regeneration index.
+
+        """
+        shards = self.lease.shards
+        return {
+            "needs_regen": True,
+            "regen_bucket": {
+                "$in": [b for b in range(REGEN_BUCKETS) if b % shards == shard]
+            },
+            "attributes.updated_at": {
+                "$lte": datetime.utcnow() - timedelta(seconds=REGEN_INTERVAL)
+            },
+        }
+
+    def run_once(self) -> RegenReport:
+        """Regenerates the characters of the held shard.
+
+        The lease is renewed after every batch and the pass stops as soon as
+        it is lost, so two workers never process the same shard for long.
+
+        Returns:
+            RegenReport: Total of the batches.
+
+        """
+        started = time.perf_counter()
+        matched = modified = 0
+        query = self.shard_query(self.lease.shard)
+        last_id = None
+        while True:
+            page = dict(query)
+            if last_id is not None:
+                page["_id"] = {"$gt": last_id}
+            ids = [
+                doc["_id"]
+                for doc in self.collection.find(page, {"_id": 1})
+                .sort("_id", 1)
+                .limit(self.batch_size)
+            ]
+            if not ids:
+                break
+            report = regenerate(
+                self.collection, {"_id": {"$in": ids}, "needs_regen": True}
+            )
+            matched += report.matched
+            modified += report.modified
+            last_id = ids[-1]
+            if len(ids) < self.batch_size or not self.lease.renew():
+                break
+        return RegenReport(matched, modified, time.perf_counter() - started)
+
+
+def run_worker(
+    shards: int,
+    first: int,
+    batch_size: int,
+    interval: float,
+    lease_ttl: float,
+    once: bool = False,
+):
+    """Runs a worker process until it is interrupted.
+
+    Args:
+        shards (int): Total number of shards.
+        first (int): The shard to try first.
+        batch_size (int): Number of characters updated with one request.
+        interval (float): Pause between the passes over the shard.
+        lease_ttl (float): Lease time. Must be longer than a batch.
+        once (bool): Make a single pass and exit.
+    """
+    connect(
+        db=config.database.db,
+        host=config.database.host,
+        port=config.database.port,
+        username=config.database.user,
+        password=config.database.password,
+    )
+    Character.assign_regen_buckets(batch_size)
+    collection = Character._get_collection()
+    lease = ShardLease(
+        collection.database[LEASES_COLLECTION], uuid.uuid4().hex, shards, lease_ttl
+    )
+    worker = RegenWorker(collection, lease, batch_size)
+    try:
+        while True:
+            if lease.shard is None or not lease.renew():
+                if lease.acquire(first) is None:
+                    log.debug("All %d shards are held, waiting", shards)
+                    time.sleep(interval)
+                    continue
+                log.info("Took shard %d/%d", lease.shard, shards)
+            report = worker.run_once()
+            log.info(
+                "Shard %s/%d: %d matched, %d modified in %.2f s",
+                lease.shard,
+                shards,
+                *report,
+            )
+            if once:
+                break
+            time.sleep(interval)
+    finally:
+        lease.release()
+
+
+def main():
+    regen = config.regeneration
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, default=regen.shards)
+    parser.add_argument(
+        "--processes", type=int, default=1, help="Workers started by this command."
+    )
+    parser.add_argument("--first", type=int, default=0, help="Shard to try first.")
+    parser.add_argument("--batch-size", type=int, default=regen.batch_size)
+    parser.add_argument("--interval", type=float, default=REGEN_INTERVAL)
+    parser.add_argument("--lease-ttl", type=float, default=regen.lease_ttl)
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(processName)s %(message)s"
+    )
+
+    options = (args.batch_size, args.interval, args.lease_ttl, args.once)
+    if args.processes == 1:
+        run_worker(args.shards, args.first, *options)
+        return
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(args.shards, args.first + number, *options),
+            name=f"regen-{number}",
+        )
+        for number in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
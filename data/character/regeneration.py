@@ -0,0 +1,179 @@
+import time
+from collections import namedtuple
+
+from pymongo.collection import Collection
+
+from .attributes import REGEN_ATTRIBUTES, REGEN_INTERVAL
+
+RegenReport = namedtuple("RegenReport", ["matched", "modified", "elapsed"])
+
+
+def _current_value(attribute: str) -> dict:
+    """Returns an expression of `Attributes.current_value`.
+
+    The expression expects the number of passed intervals in `$$ticks`.
+
+    Args:
+        attribute (str): Attribute name.
+
+    Returns:
+        dict: Aggregation expression.
+
+    """
+    main = f"$attributes.main.{attribute}_"
+    return {
+        "$let": {
+            "vars": {
+                "value": f"$attributes.{attribute}",
+                "amount": {
+                    "$divide": [
+                        {"$multiply": [f"{main}max", f"{main}regen", REGEN_INTERVAL]},
+                        100,
+                    ]
+                },
+                "total": {"$add": [f"{main}max", f"{main}buff"]},
+            },
+            "in": {
+                "$switch": {
+                    "branches": [
+                        {"case": {"$lte": ["$$ticks", 0]}, "then": "$$value"},
+                        {
+                            "case": {
+                                "$gt": [{"$add": ["$$value", "$$amount"]}, "$$total"]
+                            },
+                            "then": "$$total",
+                        },
+                        {
+                            "case": {
+                                "$lt": [{"$add": ["$$value", "$$amount"]}, 1]
+                            },
+                            "then": {
+                                "$cond": [
+                                    {"$lt": ["$$amount", 1]},
+                                    0,
+                                    {
+                                        "$min": [
+                                            {
+                                                "$multiply": [
+                                                    "$$amount",
+                                                    {"$subtract": ["$$ticks", 1]},
+                                                ]
+                                            },
+                                            "$$total",
+                                        ]
+                                    },
+                                ]
+                            },
+                        },
+                    ],
+                    "default": {
+                        "$min": [
+                            {
+                                "$add": [
+                                    "$$value",
+                                    {"$multiply": ["$$amount", "$$ticks"]},
+                                ]
+                            },
+                            "$$total",
+                        ]
+                    },
+                }
+            },
+        }
+    }
+
+
+def regen_pipeline(now="$$NOW") -> list:
+    """Returns an update pipeline that writes back regenerated attributes.
+
+    The pipeline does on the database side what `Attributes.settle` does:
+    health, stamina and magicka get the values of `Attributes.current_value`
+    and `updated_at` is moved forward by the passed whole intervals.
+    Afterwards `needs_regen` is recalculated the same way as
+    `Attributes.needs_regen` does it.
+
+    Args:
+        now (:obj:`datetime`, optional): Current UTC time. Defaults to the
+            time of the database server.
+
+    Returns:
+        list: Aggregation pipeline for `update_many`.
+
+    """
+    ticks = {
+        "$ifNull": [
+            {
+                "$floor": {
+                    "$divide": [
+                        {"$subtract": [now, "$attributes.updated_at"]},
+                        REGEN_INTERVAL * 1000,
+                    ]
+                }
+            },
+            0,
+        ]
+    }
+    stage = {
+        f"attributes.{attribute}": {
+            "$let": {"vars": {"ticks": ticks}, "in": _current_value(attribute)}
+        }
+        for attribute in REGEN_ATTRIBUTES
+    }
+    stage["attributes.updated_at"] = {
+        "$ifNull": [
+            {
+                "$add": [
+                    "$attributes.updated_at",
+                    {"$multiply": [ticks, REGEN_INTERVAL * 1000]},
+                ]
+            },
+            now,
+        ]
+    }
+    needs_regen = {
+        "$or": [
+            {
+                "$and": [
+                    {"$gt": [f"$attributes.main.{attribute}_regen", 0]},
+                    {
+                        "$lt": [
+                            f"$attributes.{attribute}",
+                            {
+                                "$add": [
+                                    f"$attributes.main.{attribute}_max",
+                                    f"$attributes.main.{attribute}_buff",
+                                ]
+                            },
+                        ]
+                    },
+                ]
+            }
+            for attribute in REGEN_ATTRIBUTES
+        ]
+    }
+    return [{"$set": stage}, {"$set": {"needs_regen": needs_regen}}]
+
+
+def regenerate(collection: Collection, query: dict = None) -> RegenReport:
+    """Writes back regenerated attributes of all matching characters in one request.
+
+    Reading a character does not require this, since the values are
+    regenerated on access. The update only refreshes the stored values.
+
+    Args:
+        collection (Collection): Characters collection.
+        query (:obj:`dict`, optional): Filter of the characters to update.
+            Defaults to the characters that need regeneration.
+
+    Returns:
+        RegenReport: The number of matched and modified characters and the
+            time spent on the update in seconds.
+
+    """
+    started = time.perf_counter()
+    if query is None:
+        query = {"needs_regen": True}
+    result = collection.update_many(query, regen_pipeline())
+    return RegenReport(
+        result.matched_count, result.modified_count, time.perf_counter() - started
+    )
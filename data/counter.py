@@ -0,0 +1,93 @@
+import threading
+from typing import Callable
+
+from mongoengine import Document, StringField, IntField
+from pymongo import ReturnDocument
+
+
+class IdCounter(Document):
+    """Counter of allocated IDs.
+
+    Attributes:
+        name (str): Counter name.
+        value (int): The last allocated ID.
+
+    """
+
+    name = StringField(primary_key=True)
+    value = IntField(default=-1)
+
+    meta = {"collection": "counters"}
+
+
+class IdAllocator:
+    """Allocates unique sequential IDs with an atomic find-and-modify.
+
+    IDs can be reserved in blocks, in which case they are handed out from
+    memory and the database is asked only once per block. IDs of a block that
+    are not used before a restart are skipped.
+
+    Attributes:
+        name (str): Counter name.
+        seed (Callable): Function that returns the largest ID already in use,
+            or -1. It is called once, so that the counter never hands out
+            IDs that existed before the counter was created.
+        block_size (int): Number of IDs reserved at once by `allocate`.
+
+    """
+
+    def __init__(self, name: str, seed: Callable[[], int] = None, block_size: int = 1):
+        self.name = name
+        self.seed = seed
+        self.block_size = block_size
+        self._seeded = False
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _ensure_seeded(self, collection):
+        if self._seeded:
+            return
+        last_id = self.seed() if self.seed else -1
+        # $max never lowers the counter, so concurrent seeding is safe
+        collection.update_one(
+            {"_id": self.name}, {"$max": {"value": last_id}}, upsert=True
+        )
+        self._seeded = True
+
+    def reserve(self, count: int) -> range:
+        """Reserves a block of IDs.
+
+        Args:
+            count (int): Number of IDs to reserve.
+
+        Returns:
+            range: Reserved IDs.
+
+        """
+        collection = IdCounter._get_collection()
+        with self._lock:
+            self._ensure_seeded(collection)
+        counter = collection.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return range(counter["value"] - count + 1, counter["value"] + 1)
+
+    def allocate(self) -> int:
+        """Returns the next free ID.
+
+        Returns:
+            int: Allocated ID.
+
+        """
+        with self._lock:
+            if self._next < self._end:
+                self._next += 1
+                return self._next - 1
+        block = self.reserve(self.block_size)
+        with self._lock:
+            self._next, self._end = block.start + 1, block.stop
+        return block.start
@@ -0,0 +1,279 @@
+import random
+from collections import namedtuple
+from typing import Callable, Optional
+
+ATTACK = "attack"
+POWER_ATTACK = "power_attack"
+BLOCK = "block"
+SPELL = "spell"
+HEAL = "heal"
+ACTIONS = (ATTACK, POWER_ATTACK, BLOCK, SPELL, HEAL)
+
+# Attribute and amount spent on the action
+COSTS = {
+    ATTACK: ("stamina", 5),
+    POWER_ATTACK: ("stamina", 25),
+    BLOCK: ("stamina", 0),
+    SPELL: ("magicka", 30),
+    HEAL: ("magicka", 25),
+}
+POWER_ATTACK_FACTOR = 2.0
+BLOCK_BASE = 0.3  # share of blocked damage at block skill 0
+BLOCK_MAX = 0.8
+BLOCK_STAMINA = 10  # stamina restored by blocking
+ARMOR_FACTOR = 0.0012  # share of physical damage absorbed per armor point
+ARMOR_MAX = 0.8
+SPELL_DAMAGE = 25
+HEAL_AMOUNT = 25
+DAMAGE_SPREAD = 0.1
+MAX_ROUNDS = 50
+
+RoundResult = namedtuple("RoundResult", "actions damage healed")
+RoundResult.__doc__ = """Result of a round.
+
+Attributes:
+    actions (tuple): Performed actions of both fighters. An action that the
+        fighter cannot afford is replaced with a block.
+    damage (tuple): Damage taken by both fighters.
+    healed (tuple): Health restored by both fighters.
+
+"""
+
+
+class Fighter:
+    """State of a character during a fight.
+
+    Everything that depends on attributes, skills and equipment is reduced to
+    a few multipliers when the fighter is created, so a round is plain
+    arithmetic on slots.
+
+    Attributes:
+        name (str): Character name.
+        health (float): Current health.
+        stamina (float): Current stamina.
+        magicka (float): Current magicka.
+        health_max (float): Maximum health.
+        stamina_max (float): Maximum stamina.
+        magicka_max (float): Maximum magicka.
+        damage (float): Weapon or unarmed damage, including the weapon skill.
+        armor (float): Share of physical damage absorbed by armor.
+        block (float): Share of damage absorbed by blocking.
+        spell_damage (float): Damage of the destruction spell.
+        spell_resist (float): Multiplier of taken spell damage.
+        heal (float): Health restored by the restoration spell.
+
+    """
+
+    __slots__ = (
+        "name",
+        "health",
+        "stamina",
+        "magicka",
+        "health_max",
+        "stamina_max",
+        "magicka_max",
+        "damage",
+        "armor",
+        "block",
+        "spell_damage",
+        "spell_resist",
+        "heal",
+    )
+
+    @classmethod
+    def from_attributes(cls, name: str, attributes, weapon=None, off_hand=None):
+        """Creates a fighter from character attributes and equipped weapons.
+
+        Args:
+            name (str): Character name.
+            attributes (Attributes): Character attributes.
+            weapon (:obj:`Weapon`, optional): Weapon in the right hand.
+            off_hand (:obj:`Item`, optional): Item in the left hand. Only a
+                weapon adds damage, half of its own.
+
+        Returns:
+            Fighter: New fighter.
+
+        """
+        skills, resists = attributes.skills, attributes.resists
+        fighter = cls()
+        fighter.name = name
+        for attribute in ("health", "stamina", "magicka"):
+            setattr(fighter, attribute, float(getattr(attributes, attribute)))
+            total = attributes.get_total_value(attribute)
+            setattr(fighter, f"{attribute}_max", float(total))
+        if getattr(weapon, "damage", None) is not None:
+            if weapon.attack_type == "range":
+                skill = skills.get("archery", 0)
+            elif weapon.hands == 2:
+                skill = skills.get("two_handed", 0)
+            else:
+                skill = skills.get("one_handed", 0)
+            damage = weapon.damage * (1 + skill / 200)
+            if getattr(off_hand, "damage", None) is not None:
+                damage += off_hand.damage * (1 + skills.get("one_handed", 0) / 200) / 2
+        else:
+            damage = attributes.unarmed_damage or 0
+        fighter.damage = float(damage)
+        fighter.armor = min(attributes.armor_rating * ARMOR_FACTOR, ARMOR_MAX)
+        fighter.block = min(BLOCK_BASE + skills.get("block", 0) / 200, BLOCK_MAX)
+        fighter.spell_damage = SPELL_DAMAGE * (1 + skills.get("destruction", 0) / 100)
+        fighter.spell_resist = resists.get("fire_resist", 1) * resists.get(
+            "magic_resist", 1
+        )
+        fighter.heal = HEAL_AMOUNT * (1 + skills.get("restoration", 0) / 100)
+        return fighter
+
+    @property
+    def alive(self) -> bool:
+        return self.health >= 1
+
+    def can_afford(self, action: str) -> bool:
+        """Returns whether the fighter has enough stamina or magicka.
+
+        Args:
+            action (str): Action name.
+
+        Returns:
+            bool: The action can be performed or not.
+
+        """
+        attribute, cost = COSTS[action]
+        return getattr(self, attribute) >= cost
+
+    def apply_to(self, attributes):
+        """Writes health, stamina and magicka back to the attributes.
+
+        A duel is not lethal: the defeated fighter keeps 1 health, so that it
+        can fight again.
+
+        Args:
+            attributes (Attributes): Attributes the fighter was created from.
+        """
+        attributes.health = max(self.health, 1)
+        attributes.stamina = self.stamina
+        attributes.magicka = self.magicka
+
+
+def _incoming(
+    attacker: Fighter, action: str, defender: Fighter, defence: str, spread: float
+) -> float:
+    if action == ATTACK or action == POWER_ATTACK:
+        damage = attacker.damage * (1 - defender.armor)
+        if action == POWER_ATTACK:
+            damage *= POWER_ATTACK_FACTOR
+        if defence == BLOCK:
+            # A power attack breaks through half of the block
+            damage *= 1 - (
+                defender.block / 2 if action == POWER_ATTACK else defender.block
+            )
+    elif action == SPELL:
+        damage = attacker.spell_damage * defender.spell_resist
+        if defence == BLOCK:
+            damage *= 1 - defender.block / 2
+    else:
+        return 0.0
+    return damage * spread
+
+
+def resolve_round(
+    first: Fighter, second: Fighter, actions: tuple, rng: random.Random
+) -> RoundResult:
+    """Resolves a round in which both fighters act at the same time.
+
+    Damage of both fighters is calculated from the state before the round,
+    then both fighters are updated in place. Healing takes effect after
+    damage and cannot save a fighter who has fallen.
+
+    Args:
+        first (Fighter): The first fighter.
+        second (Fighter): The second fighter.
+        actions (tuple): Actions of the first and the second fighter.
+        rng (random.Random): Source of random damage spread.
+
+    Returns:
+        RoundResult: Round result.
+
+    """
+    first_action, second_action = actions
+    if not first.can_afford(first_action):
+        first_action = BLOCK
+    if not second.can_afford(second_action):
+        second_action = BLOCK
+    to_first = _incoming(
+        second,
+        second_action,
+        first,
+        first_action,
+        1 + DAMAGE_SPREAD * (2 * rng.random() - 1),
+    )
+    to_second = _incoming(
+        first,
+        first_action,
+        second,
+        second_action,
+        1 + DAMAGE_SPREAD * (2 * rng.random() - 1),
+    )
+    healed = [0.0, 0.0]
+    for index, (fighter, action, damage) in enumerate(
+        ((first, first_action, to_first), (second, second_action, to_second))
+    ):
+        attribute, cost = COSTS[action]
+        setattr(fighter, attribute, getattr(fighter, attribute) - cost)
+        if action == BLOCK:
+            fighter.stamina = min(fighter.stamina + BLOCK_STAMINA, fighter.stamina_max)
+        fighter.health = max(fighter.health - damage, 0.0)
+        if action == HEAL and fighter.alive:
+            health = min(fighter.health + fighter.heal, fighter.health_max)
+            healed[index] = health - fighter.health
+            fighter.health = health
+    return RoundResult(
+        (first_action, second_action), (to_first, to_second), tuple(healed)
+    )
+
+
+def winner(first: Fighter, second: Fighter) -> Optional[int]:
+    """Returns the index of the winner.
+
+    Args:
+        first (Fighter): The first fighter.
+        second (Fighter): The second fighter.
+
+    Returns:
+        Optional[int]: 0 or 1 if only one fighter is still standing, otherwise
+            None.
+
+    """
+    if first.alive == second.alive:
+        return None
+    return 0 if first.alive else 1
+
+
+def fight(
+    first: Fighter,
+    second: Fighter,
+    choose: Callable[[Fighter, Fighter, random.Random], str],
+    rng: random.Random,
+    max_rounds: int = MAX_ROUNDS,
+) -> Optional[int]:
+    """Plays a whole fight with actions chosen by a strategy.
+
+    Args:
+        first (Fighter): The first fighter.
+        second (Fighter): The second fighter.
+        choose (Callable): Returns the action of the fighter given the fighter,
+            the opponent and `rng`.
+        rng (random.Random): Source of randomness.
+        max_rounds (int): The fight ends in a draw after this number of
+            rounds. Defaults to `MAX_ROUNDS`.
+
+    Returns:
+        Optional[int]: Index of the winner or None on a draw.
+
+    """
+    for _ in range(max_rounds):
+        if not (first.alive and second.alive):
+            break
+        actions = (choose(first, second, rng), choose(second, first, rng))
+        resolve_round(first, second, actions, rng)
+    return winner(first, second)
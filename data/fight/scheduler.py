@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Callable, Hashable, Iterable
+
+import discord
+from redbot.core.utils.menus import start_adding_reactions
+
+from ..session.fight_session import ACCEPT, CHALLENGE, CONTROLS, FightSession
+
+log = logging.getLogger("red.rpg")
+
+
+class Timer:
+    """Timer scheduled on a `TimerWheel`."""
+
+    __slots__ = ("callback", "args", "rotations", "slot", "cancelled")
+
+    def __init__(self, callback: Callable, args: tuple, rotations: int, slot: int):
+        self.callback = callback
+        self.args = args
+        self.rotations = rotations
+        self.slot = slot
+        self.cancelled = False
+
+
+class TimerWheel:
+    """Hashed timer wheel.
+
+    Timers are kept in slots by expiration tick, so scheduling and cancelling
+    take constant time and a single task serves any number of timers. Timers
+    fire with the precision of a tick.
+
+    Attributes:
+        tick (float): Tick length in seconds.
+
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tick: float = 1.0, size=64):
+        self.tick = tick
+        self._loop = loop
+        self._slots = [set() for _ in range(size)]
+        self._position = 0
+        self._count = 0
+        self._task = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def start(self):
+        """Starts the task that advances the wheel."""
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        """Stops the wheel. Scheduled timers do not fire."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """Schedules the callback.
+
+        Args:
+            delay (float): Delay in seconds.
+            callback (Callable): Function to call.
+            *args: Arguments of the callback.
+
+        Returns:
+            Timer: Timer that can be cancelled.
+
+        """
+        ticks = max(1, math.ceil(delay / self.tick))
+        size = len(self._slots)
+        slot = (self._position + ticks) % size
+        timer = Timer(callback, args, (ticks - 1) // size, slot)
+        self._slots[slot].add(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer: Timer):
+        """Cancels the timer if it has not fired yet.
+
+        Args:
+            timer (Timer): Scheduled timer.
+        """
+        if not timer.cancelled:
+            timer.cancelled = True
+            self._slots[timer.slot].discard(timer)
+            self._count -= 1
+
+    def advance(self):
+        """Moves the wheel one tick forward and fires the expired timers."""
+        self._position = (self._position + 1) % len(self._slots)
+        slot = self._slots[self._position]
+        expired = []
+        for timer in slot:
+            if timer.rotations:
+                timer.rotations -= 1
+            else:
+                expired.append(timer)
+        for timer in expired:
+            slot.discard(timer)
+            timer.cancelled = True
+            self._count -= 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                log.exception("Timer callback %r failed", timer.callback)
+
+    async def _run(self):
+        deadline = self._loop.time()
+        while True:
+            deadline += self.tick
+            await asyncio.sleep(max(0.0, deadline - self._loop.time()))
+            self.advance()
+
+
+class FightScheduler:
+    """Runs all fights of the cog.
+
+    A single timer wheel serves turn timeouts, reactions are routed to the
+    fights by message ID, and message edits go through a queue that is
+    processed by a fixed number of workers. Pending edits of a fight are
+    coalesced, so the queue holds at most one entry per fight and a slow
+    Discord API delays edits instead of piling them up.
+
+    Attributes:
+        bot (Red): Bot instance. `fight_end` is dispatched on it when a fight
+            ends.
+        turn_timeout (float): Time to choose an action or to accept a challenge.
+        max_fights (int): Maximum number of simultaneous fights.
+
+    """
+
+    def __init__(
+        self,
+        bot,
+        turn_timeout: float,
+        tick: float = 1.0,
+        edit_workers: int = 4,
+        max_fights: int = 5000,
+        latency_window: int = 1000,
+    ):
+        self.bot = bot
+        self.turn_timeout = turn_timeout
+        self.max_fights = max_fights
+        self.wheel = TimerWheel(bot.loop, tick)
+        self._by_message = {}
+        self._timers = {}
+        self._busy = set()
+        self._fights = 0
+        self._dirty = {}
+        self._edits = asyncio.Queue()
+        self._latencies = deque(maxlen=latency_window)
+        self.wheel.start()
+        self._workers = [
+            bot.loop.create_task(self._edit_worker()) for _ in range(edit_workers)
+        ]
+
+    @property
+    def active(self) -> int:
+        return self._fights
+
+    @property
+    def queue_depth(self) -> int:
+        return self._edits.qsize()
+
+    @property
+    def full(self) -> bool:
+        return self._fights >= self.max_fights
+
+    def is_busy(self, user_id: Hashable) -> bool:
+        return user_id in self._busy
+
+    def reserve(self, user_ids: Iterable[Hashable]) -> bool:
+        """Locks the users for a new fight.
+
+        The check and the lock are done at once, so two duels cannot take the
+        same user even if they are being prepared at the same time.
+
+        Args:
+            user_ids (Iterable[Hashable]): User IDs.
+
+        Returns:
+            bool: Whether the users were locked. False if one of them is
+                already fighting or the scheduler is full.
+
+        """
+        user_ids = set(user_ids)
+        if self.full or not self._busy.isdisjoint(user_ids):
+            return False
+        self._busy.update(user_ids)
+        self._fights += 1
+        return True
+
+    def release(self, user_ids: Iterable[Hashable]):
+        """Unlocks the users reserved for a fight that has not started.
+
+        Args:
+            user_ids (Iterable[Hashable]): User IDs.
+        """
+        self._busy.difference_update(user_ids)
+        self._fights -= 1
+
+    async def start(self, session: FightSession):
+        """Sends the challenge and starts the fight.
+
+        Members of the session must be reserved with `FightScheduler.reserve`.
+
+        Args:
+            session (FightSession): New fight session.
+        """
+        try:
+            session.message = await session.ctx.send(embed=session.render())
+        except discord.HTTPException:
+            self.release(member.id for member in session.members)
+            raise
+        self._by_message[session.message.id] = session
+        start_adding_reactions(session.message, ACCEPT)
+        self._restart_timer(session)
+
+    def on_reaction(self, reaction: discord.Reaction, user):
+        """Passes the reaction to the fight the message belongs to.
+
+        Both added and removed reactions are passed, so a member can choose
+        the same action again without removing the reaction first.
+
+        Args:
+            reaction (discord.Reaction): Reaction.
+            user (Union[discord.Member, discord.User]): The user who reacted.
+        """
+        session = self._by_message.get(reaction.message.id)
+        if session is None or user.bot:
+            return
+        state = session.state
+        if not session.react(user, str(reaction.emoji)):
+            return
+        if state == CHALLENGE and not session.finished:
+            start_adding_reactions(session.message, CONTROLS)
+        self._changed(session)
+
+    def _timeout(self, session: FightSession):
+        self._timers.pop(session, None)
+        session.timeout()
+        self._changed(session)
+
+    def _restart_timer(self, session: FightSession):
+        timer = self._timers.pop(session, None)
+        if timer is not None:
+            self.wheel.cancel(timer)
+        if not session.finished:
+            self._timers[session] = self.wheel.schedule(
+                self.turn_timeout, self._timeout, session
+            )
+
+    def _changed(self, session: FightSession):
+        self._restart_timer(session)
+        if session not in self._dirty:
+            self._dirty[session] = time.monotonic()
+            self._edits.put_nowait(session)
+        if session.finished:
+            self._end(session)
+
+    def _end(self, session: FightSession):
+        self._by_message.pop(session.message.id, None)
+        self._busy.difference_update(member.id for member in session.members)
+        self._fights -= 1
+        self.bot.dispatch("fight_end", session)
+
+    async def _edit_worker(self):
+        while True:
+            session = await self._edits.get()
+            changed = self._dirty.pop(session)
+            try:
+                await session.message.edit(embed=session.render())
+                if session.finished:
+                    await session.message.clear_reactions()
+            except (discord.Forbidden, discord.NotFound):
+                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The worker must survive anything, or the edit queue stops
+                log.exception("Failed to update fight message")
+            self._latencies.append(time.monotonic() - changed)
+
+    def latency(self) -> dict:
+        """Returns statistics of the turn latency.
+
+        The turn latency is the time from a change of a fight to the update
+        of its message, over the last updates.
+
+        Returns:
+            dict: Count, mean, p50, p95 and max in seconds.
+
+        """
+        values = sorted(self._latencies)
+        if not values:
+            return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+        }
+
+    def close(self):
+        """Stops the scheduler. Running fights end without a result."""
+        self.wheel.stop()
+        for worker in self._workers:
+            worker.cancel()
+        for session in list(self._by_message.values()):
+            session.stop()
+        self._by_message.clear()
+        self._timers.clear()
+        self._busy.clear()
+        self._fights = 0
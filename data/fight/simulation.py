@@ -0,0 +1,380 @@
+"""Monte Carlo fight simulator for balance testing.
+
+Runs many duels at once with the rules of `data.fight.combat` vectorized
+with NumPy, spread over a process pool. Each loadout is a race, optionally
+followed by IDs of equipped items from a file made by `item export`:
+
+    python -m rpg.data.fight.simulation nord khajit:12,40 --items items.jsonl
+
+Without loadouts all races fight each other unarmed.
+
+"""
+import argparse
+import itertools as it
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Sequence
+
+import numpy as np
+
+from ...config import config
+from ..character.attributes import race_templates
+from ..item.item import Armor, Item, Weapon
+from ..item.transfer import build_item, read_rows
+from .combat import (
+    ACTIONS,
+    ATTACK,
+    BLOCK,
+    BLOCK_STAMINA,
+    COSTS,
+    DAMAGE_SPREAD,
+    HEAL,
+    MAX_ROUNDS,
+    POWER_ATTACK,
+    POWER_ATTACK_FACTOR,
+    SPELL,
+    Fighter,
+)
+
+_ATTACK = ACTIONS.index(ATTACK)
+_POWER_ATTACK = ACTIONS.index(POWER_ATTACK)
+_BLOCK = ACTIONS.index(BLOCK)
+_SPELL = ACTIONS.index(SPELL)
+_HEAL = ACTIONS.index(HEAL)
+_USES_MAGICKA = np.array([COSTS[action][0] == "magicka" for action in ACTIONS])
+_COST = np.array([COSTS[action][1] for action in ACTIONS], dtype=float)
+
+Outcome = namedtuple("Outcome", "wins rounds")
+Outcome.__doc__ = """Outcome of a batch of fights.
+
+Attributes:
+    wins (numpy.ndarray): Number of wins of the first and the second fighter
+        and the number of draws.
+    rounds (numpy.ndarray): Number of fights by the number of rounds they
+        lasted, indexed by round count.
+
+"""
+
+
+class _Side:
+    """Fighter state of a batch of fights as arrays."""
+
+    __slots__ = ("fighter", "health", "stamina", "magicka")
+
+    def __init__(self, fighter: Fighter, count: int):
+        self.fighter = fighter
+        self.health = np.full(count, fighter.health)
+        self.stamina = np.full(count, fighter.stamina)
+        self.magicka = np.full(count, fighter.magicka)
+
+    def compress(self, mask: np.ndarray):
+        self.health = self.health[mask]
+        self.stamina = self.stamina[mask]
+        self.magicka = self.magicka[mask]
+
+    def affordable(self, actions: np.ndarray) -> np.ndarray:
+        pool = np.where(_USES_MAGICKA[actions], self.magicka, self.stamina)
+        return pool >= _COST[actions]
+
+
+def _incoming(
+    attacker: Fighter,
+    actions: np.ndarray,
+    defender: Fighter,
+    defence: np.ndarray,
+    spread: np.ndarray,
+) -> np.ndarray:
+    blocked = defence == _BLOCK
+    power = actions == _POWER_ATTACK
+    physical = (
+        attacker.damage
+        * (1 - defender.armor)
+        * np.where(power, POWER_ATTACK_FACTOR, 1.0)
+    )
+    physical *= np.where(
+        blocked, 1 - np.where(power, defender.block / 2, defender.block), 1.0
+    )
+    spell = attacker.spell_damage * defender.spell_resist
+    spell *= np.where(blocked, 1 - defender.block / 2, 1.0)
+    damage = np.where(
+        (actions == _ATTACK) | power, physical, np.where(actions == _SPELL, spell, 0.0)
+    )
+    return damage * spread
+
+
+def resolve_rounds(
+    first: _Side,
+    second: _Side,
+    actions: tuple,
+    spread: tuple,
+) -> tuple:
+    """Resolves a round of every fight in the batch.
+
+    Vectorized `combat.resolve_round`.
+
+    Args:
+        first (_Side): The first fighters.
+        second (_Side): The second fighters.
+        actions (tuple): Action indices in `combat.ACTIONS` of both sides.
+        spread (tuple): Damage multipliers of the damage taken by both sides.
+
+    Returns:
+        tuple: Performed actions of both sides.
+
+    """
+    actions = tuple(
+        np.where(side.affordable(side_actions), side_actions, _BLOCK)
+        for side, side_actions in zip((first, second), actions)
+    )
+    to_first = _incoming(
+        second.fighter, actions[1], first.fighter, actions[0], spread[0]
+    )
+    to_second = _incoming(
+        first.fighter, actions[0], second.fighter, actions[1], spread[1]
+    )
+    for side, side_actions, damage in (
+        (first, actions[0], to_first),
+        (second, actions[1], to_second),
+    ):
+        fighter = side.fighter
+        cost = _COST[side_actions]
+        magicka = _USES_MAGICKA[side_actions]
+        side.stamina = np.where(magicka, side.stamina, side.stamina - cost)
+        side.magicka = np.where(magicka, side.magicka - cost, side.magicka)
+        side.stamina = np.where(
+            side_actions == _BLOCK,
+            np.minimum(side.stamina + BLOCK_STAMINA, fighter.stamina_max),
+            side.stamina,
+        )
+        side.health = np.maximum(side.health - damage, 0.0)
+        side.health = np.where(
+            (side_actions == _HEAL) & (side.health >= 1),
+            np.minimum(side.health + fighter.heal, fighter.health_max),
+            side.health,
+        )
+    return actions
+
+
+def simulate(
+    first: Fighter,
+    second: Fighter,
+    count: int,
+    weights: Sequence[float] = None,
+    seed=None,
+    max_rounds: int = MAX_ROUNDS,
+) -> Outcome:
+    """Plays a batch of fights between two fighters.
+
+    Both fighters choose their actions at random, see `weights`.
+
+    Args:
+        first (Fighter): The first fighter.
+        second (Fighter): The second fighter.
+        count (int): Number of fights.
+        weights (:obj:`Sequence[float]`, optional): Probabilities of the
+            actions in the order of `combat.ACTIONS`. Uniform if omitted.
+        seed (optional): Seed of the random generator.
+        max_rounds (int): The fight ends in a draw after this number of
+            rounds. Defaults to `combat.MAX_ROUNDS`.
+
+    Returns:
+        Outcome: Outcome of the fights.
+
+    """
+    rng = np.random.default_rng(seed)
+    sides = (_Side(first, count), _Side(second, count))
+    wins = np.zeros(3, dtype=np.int64)
+    rounds = np.zeros(max_rounds + 1, dtype=np.int64)
+    active = count
+    for number in range(max_rounds + 1):
+        alive = [side.health >= 1 for side in sides]
+        running = alive[0] & alive[1]
+        if number == max_rounds:
+            running[:] = False
+        finished = ~running
+        if finished.any():
+            first_alive, second_alive = alive[0][finished], alive[1][finished]
+            wins[0] += np.count_nonzero(first_alive & ~second_alive)
+            wins[1] += np.count_nonzero(second_alive & ~first_alive)
+            wins[2] += np.count_nonzero(first_alive == second_alive)
+            rounds[number] += np.count_nonzero(finished)
+            active -= np.count_nonzero(finished)
+            for side in sides:
+                side.compress(running)
+        if not active:
+            break
+        actions = tuple(rng.choice(len(ACTIONS), size=active, p=weights) for _ in sides)
+        spread = tuple(1 + DAMAGE_SPREAD * (2 * rng.random(active) - 1) for _ in sides)
+        resolve_rounds(*sides, actions, spread)
+    return Outcome(wins, rounds)
+
+
+def simulate_parallel(
+    first: Fighter,
+    second: Fighter,
+    count: int,
+    weights: Sequence[float] = None,
+    seed=None,
+    workers: int = None,
+    chunk_size: int = 250000,
+    executor: ProcessPoolExecutor = None,
+) -> Outcome:
+    """Plays a batch of fights in several processes.
+
+    Args:
+        first (Fighter): The first fighter.
+        second (Fighter): The second fighter.
+        count (int): Number of fights.
+        weights (:obj:`Sequence[float]`, optional): See `simulate`.
+        seed (optional): Seed of the random generators of the chunks.
+        workers (:obj:`int`, optional): Number of processes. Defaults to the
+            number of CPUs.
+        chunk_size (int): Maximum number of fights simulated by a process at
+            once. Limits the memory used by the arrays.
+        executor (:obj:`ProcessPoolExecutor`, optional): Pool to use instead
+            of a new one.
+
+    Returns:
+        Outcome: Outcome of the fights.
+
+    """
+    chunks = [chunk_size] * (count // chunk_size)
+    if count % chunk_size:
+        chunks.append(count % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        outcomes = list(
+            executor.map(
+                simulate,
+                it.repeat(first),
+                it.repeat(second),
+                chunks,
+                it.repeat(weights),
+                seeds,
+            )
+        )
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return Outcome(
+        sum(outcome.wins for outcome in outcomes),
+        sum(outcome.rounds for outcome in outcomes),
+    )
+
+
+def load_items(file_path: str) -> Dict[int, Item]:
+    """Loads items from a file made by `item export`.
+
+    Args:
+        file_path (str): Path to a jsonl or csv file.
+
+    Returns:
+        Dict[int, Item]: Items by ID.
+
+    """
+    fmt = os.path.splitext(file_path)[1].lstrip(".").lower()
+    with open(file_path, encoding="utf-8", newline="") as stream:
+        return {
+            int(row["item_id"]): build_item(row, int(row["item_id"]))
+            for row in read_rows(stream, fmt)
+        }
+
+
+def build_fighter(loadout: str, templates: dict, items: Dict[int, Item]) -> Fighter:
+    """Creates a fighter from the loadout.
+
+    Args:
+        loadout (str): Race, optionally followed by a colon and comma
+            separated item IDs. The first weapon is taken in the right hand,
+            the second one in the left hand if the first one is one-handed.
+            Armor adds to the armor rating.
+        templates (dict): Attribute templates by race.
+        items (Dict[int, Item]): Items by ID.
+
+    Returns:
+        Fighter: New fighter named after the loadout.
+
+    Raises:
+        ValueError: If the race or an item is unknown.
+
+    """
+    race, _, item_ids = loadout.partition(":")
+    try:
+        attributes = templates[race].create()
+    except KeyError:
+        raise ValueError(f"Unknown race: {race}")
+    weapons = []
+    for item_id in filter(None, item_ids.split(",")):
+        try:
+            item = items[int(item_id)]
+        except (KeyError, ValueError):
+            raise ValueError(f"Unknown item: {item_id}")
+        if isinstance(item, Weapon):
+            weapons.append(item)
+        elif isinstance(item, Armor):
+            attributes.armor_rating += item.armor or 0
+    weapon = weapons[0] if weapons else None
+    off_hand = weapons[1] if len(weapons) > 1 and weapon.hands != 2 else None
+    return Fighter.from_attributes(loadout, attributes, weapon, off_hand)
+
+
+def _percentile(rounds: np.ndarray, share: float) -> int:
+    return int(np.searchsorted(np.cumsum(rounds), share * rounds.sum()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("loadouts", nargs="*", help="race[:item_id,...]")
+    parser.add_argument("--items", help="Items exported with `item export`.")
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument(
+        "--weights",
+        type=lambda value: [float(weight) for weight in value.split(",")],
+        help=f"Probabilities of the actions: {','.join(ACTIONS)}.",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    weights = args.weights
+    if weights is not None:
+        if len(weights) != len(ACTIONS):
+            parser.error(f"--weights needs {len(ACTIONS)} values")
+        weights = np.array(weights) / sum(weights)
+    items = load_items(args.items) if args.items else {}
+    templates = race_templates(config.race_stats)
+    loadouts = args.loadouts or list(templates)
+    try:
+        fighters = [build_fighter(loadout, templates, items) for loadout in loadouts]
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(
+        f"{'first':>20} {'second':>20} {'win 1':>7} {'win 2':>7} {'draw':>7}"
+        f" {'rounds':>6} {'p50':>4} {'p90':>4} {'p99':>4}"
+    )
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for first, second in it.combinations(fighters, 2):
+            outcome = simulate_parallel(
+                first, second, args.count, weights, args.seed, executor=executor
+            )
+            wins = outcome.wins / args.count
+            rounds = outcome.rounds
+            mean = (rounds * np.arange(len(rounds))).sum() / args.count
+            print(
+                f"{first.name:>20} {second.name:>20} "
+                f"{wins[0]:7.2%} {wins[1]:7.2%} {wins[2]:7.2%} {mean:6.1f} "
+                f"{_percentile(rounds, 0.5):4} {_percentile(rounds, 0.9):4} "
+                f"{_percentile(rounds, 0.99):4}"
+            )
+    print(f"{time.perf_counter() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+from typing import Dict, Iterable, List, Optional
+
+from .item import Item, ItemNotFound
+from .search import ItemSearchIndex
+
+
+class ItemCatalog:
+    """In-memory catalog of all items.
+
+    The catalog is small and changes only when items are created, so it is
+    loaded once and then kept up to date by `ItemCatalog.add`.
+
+    Attributes:
+        document (type): Item document class.
+        loaded (bool): Whether the catalog has been loaded from the database.
+
+    """
+
+    def __init__(self, document: type = Item):
+        self.document = document
+        self.loaded = False
+        self._by_id = {}
+        self._by_name = {}
+        self._by_category = {}
+        self._search_index = ItemSearchIndex()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def load(self):
+        """Loads all items from the database and rebuilds the indexes.
+
+        The indexes are replaced at once, so lookups stay consistent while the
+        catalog is being loaded.
+
+        """
+        by_id, by_name, by_category = {}, {}, {}
+        search_index = ItemSearchIndex()
+        for item in self.document.objects:
+            self._index(item, by_id, by_name, by_category)
+            search_index.add(item.item_id, item.name)
+        self._by_id, self._by_name, self._by_category = by_id, by_name, by_category
+        self._search_index = search_index
+        self.loaded = True
+
+    @staticmethod
+    def _index(item: Item, by_id: dict, by_name: dict, by_category: dict):
+        by_id[item.item_id] = item
+        by_name.setdefault(item.name, {})[item.item_id] = item
+        by_category.setdefault(item.category, {})[item.item_id] = item
+
+    def add(self, item: Item):
+        """Adds a new or updated item to the catalog.
+
+        Args:
+            item (Item): Saved item.
+        """
+        old = self._by_id.get(item.item_id)
+        if old is not None:
+            self._by_name.get(old.name, {}).pop(old.item_id, None)
+            self._by_category.get(old.category, {}).pop(old.item_id, None)
+        self._index(item, self._by_id, self._by_name, self._by_category)
+        self._search_index.add(item.item_id, item.name)
+
+    def extend(self, items: Iterable[Item]):
+        """Adds several items to the catalog.
+
+        Args:
+            items (Iterable[Item]): Saved items.
+        """
+        for item in items:
+            self.add(item)
+
+    def get_by_id(self, item_id: int) -> Item:
+        """Returns the item by the given id.
+
+        Args:
+            item_id (int): Item ID.
+
+        Returns:
+            Item: Item object.
+
+        Raises:
+            ItemNotFound: If the item is not found.
+
+        """
+        try:
+            return self._by_id[item_id]
+        except KeyError:
+            raise ItemNotFound
+
+    def get(self, item_id: int) -> Optional[Item]:
+        """Returns the item by the given id, or None if it is not found.
+
+        Args:
+            item_id (int): Item ID.
+
+        Returns:
+            Optional[Item]: Item object.
+
+        """
+        return self._by_id.get(item_id)
+
+    def get_many(self, item_ids: Iterable[int]) -> Dict[int, Item]:
+        """Returns the items with the given IDs.
+
+        Args:
+            item_ids (Iterable[int]): Item IDs.
+
+        Returns:
+            dict: Items by ID. IDs missing from the catalog are skipped.
+
+        """
+        by_id = self._by_id
+        return {item_id: by_id[item_id] for item_id in item_ids if item_id in by_id}
+
+    def get_by_name(self, name: str) -> List[Item]:
+        """Returns a list of items with the given name.
+
+        Args:
+            name (str): Item name.
+
+        Returns:
+            list: List of items.
+
+        """
+        return list(self._by_name.get(name, {}).values())
+
+    def search(self, query: str, limit: int = 10) -> List[Item]:
+        """Returns the items with the best matching names.
+
+        The query may be a part of the name or contain typos. Only the best
+        group of matches is returned, see `ItemSearchIndex.best_matches`.
+
+        Args:
+            query (str): Full or partial item name.
+            limit (int): The maximum number of items. Defaults to 10.
+
+        Returns:
+            list: List of items, best matches first.
+
+        """
+        return [
+            self._by_id[item_id]
+            for item_id in self._search_index.best_matches(query, limit)
+        ]
+
+    def get_by_category(self, category: str) -> List[Item]:
+        """Returns a list of items of the category.
+
+        Args:
+            category (str): Category name. May be Item, Weapon or Armor.
+
+        Returns:
+            list: List of items.
+
+        """
+        return list(self._by_category.get(category, {}).values())
@@ -2,6 +2,8 @@ import re
 
 from mongoengine import Document, IntField, StringField
 
+from ..counter import IdAllocator
+
 
 class Item(Document):
     """Item class
@@ -114,18 +116,30 @@ class Item(Document):
         return items.first()
 
     @classmethod
-    def get_next_id(cls) -> int:
-        """Returns the next free id.
+    def get_last_id(cls) -> int:
+        """Returns the largest id in use.
 
         Returns:
-            int: Next free id.
+            int: The largest id, or -1 if there are no items.
 
         """
         try:
-            item_id = int(cls.objects.order_by("-_id").first().item_id) + 1
+            return int(cls.objects.order_by("-_id").first().item_id)
         except AttributeError:
-            item_id = 0
-        return item_id
+            return -1
+
+    @classmethod
+    def get_next_id(cls) -> int:
+        """Allocates the next free id.
+
+        The id is taken from an atomic counter, so concurrent calls never get
+        the same id.
+
+        Returns:
+            int: Next free id.
+
+        """
+        return item_ids.allocate()
 
     meta = {"allow_inheritance": True}
 
@@ -308,6 +322,9 @@ class Weapon(Item):
         return self.weapon_types[self.weapon_type].title()
 
 
+item_ids = IdAllocator("item_id", seed=Item.get_last_id)
+
+
 class ItemNotFound(Exception):
     """Raises if the item is not found in the database."""
 
@@ -0,0 +1,253 @@
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Hashable, List, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(name: str) -> str:
+    """Returns the name in the form used for searching.
+
+    The name is case-folded, `ё` is replaced with `е` and whitespace is
+    collapsed.
+
+    Args:
+        name (str): Item name.
+
+    Returns:
+        str: Normalized name.
+
+    """
+    return _WHITESPACE.sub(" ", name.casefold().replace("ё", "е")).strip()
+
+
+def trigrams(name: str) -> set:
+    """Returns the trigrams of the normalized name.
+
+    Args:
+        name (str): Normalized name.
+
+    Returns:
+        set: Set of trigrams.
+
+    """
+    padded = f"  {name} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class ItemSearchIndex:
+    """Search index over item names.
+
+    Names are matched case-insensitively. Exact matches rank first, then
+    names starting with the query, then names with a word starting with the
+    query, then names similar to the query by trigrams.
+
+    Attributes:
+        min_similarity (float): The minimum trigram similarity of a fuzzy match.
+
+    """
+
+    EXACT = 3.0
+    PREFIX = 2.0
+    WORD_PREFIX = 1.0
+    FUZZY_CANDIDATES = 20
+    FUZZY_BUDGET = 2000
+
+    def __init__(self, min_similarity: float = 0.3):
+        self.min_similarity = min_similarity
+        self._names = {}
+        self._grams = {}
+        self._postings = defaultdict(set)
+        self._words = []
+        self._full = []
+        self._words_sorted = True
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, key: Hashable, name: str):
+        """Adds the name to the index, replacing the previous name of the key.
+
+        Args:
+            key (Hashable): Item key, usually the item ID.
+            name (str): Item name.
+        """
+        if key in self._names:
+            self.remove(key)
+        name = normalize(name)
+        grams = trigrams(name)
+        self._names[key] = name
+        self._grams[key] = len(grams)
+        for gram in grams:
+            self._postings[gram].add(key)
+        for position in self._word_starts(name):
+            self._words.append((name[position:], position, key))
+        self._full.append((name, key))
+        self._words_sorted = False
+
+    def remove(self, key: Hashable):
+        """Removes the key from the index.
+
+        Args:
+            key (Hashable): Item key.
+        """
+        name = self._names.pop(key, None)
+        if name is None:
+            return
+        del self._grams[key]
+        self._sort_words()
+        for gram in trigrams(name):
+            postings = self._postings[gram]
+            postings.discard(key)
+            if not postings:
+                del self._postings[gram]
+        for position in self._word_starts(name):
+            entry = (name[position:], position, key)
+            index = bisect_left(self._words, entry)
+            if index < len(self._words) and self._words[index] == entry:
+                del self._words[index]
+        index = bisect_left(self._full, (name, key))
+        if index < len(self._full) and self._full[index] == (name, key):
+            del self._full[index]
+
+    def _sort_words(self):
+        # Words are sorted lazily, so that loading a catalog stays O(n log n)
+        if not self._words_sorted:
+            self._words.sort()
+            self._full.sort()
+            self._words_sorted = True
+
+    @staticmethod
+    def _word_starts(name: str):
+        position = 0
+        for word in name.split(" "):
+            yield position
+            position += len(word) + 1
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[Hashable, float]]:
+        """Returns the keys of the best matching names.
+
+        Args:
+            query (str): Full or partial item name.
+            limit (int): The maximum number of results. Defaults to 10.
+
+        Returns:
+            list: Pairs of the key and its score, best matches first.
+
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        self._sort_words()
+        scores = {}
+        # Names starting with the query are scanned separately, in name
+        # order, so they are never crowded out by matches inside names
+        index = bisect_left(self._full, (query,))
+        end = min(index + limit, len(self._full))
+        while index < end:
+            name, key = self._full[index]
+            if not name.startswith(query):
+                break
+            scores[key] = self.EXACT if name == query else self.PREFIX
+            index += 1
+        if len(scores) < limit:
+            index = bisect_left(self._words, (query,))
+            end = min(index + limit * 20, len(self._words))
+            while index < end:
+                suffix, position, key = self._words[index]
+                if not suffix.startswith(query):
+                    break
+                if position and key not in scores:
+                    scores[key] = self.WORD_PREFIX
+                index += 1
+
+        if not scores:
+            scores = self._fuzzy(query, limit)
+
+        ranked = sorted(
+            scores.items(), key=lambda pair: (-pair[1], self._names[pair[0]])
+        )
+        return ranked[:limit]
+
+    def _fuzzy(self, query: str, limit: int) -> dict:
+        """Returns the keys with trigram similarity to the query.
+
+        Candidates come from two sources, so that only a few hundred names are
+        scored exactly:
+
+        - Names sharing the rarest trigrams of the query. Their postings are
+          counted until `FUZZY_BUDGET` postings are reached, and only the
+          names with at least half of the best count are kept.
+        - Names sharing all the common trigrams, found by intersecting the
+          remaining postings until few names are left. A trigram that would
+          leave no names is skipped. This finds a name whose rare parts are
+          misspelled.
+
+        Each source gives at most `FUZZY_CANDIDATES` names per result.
+
+        Args:
+            query (str): Normalized query.
+            limit (int): The number of results that will be used.
+
+        Returns:
+            dict: Similarity by key.
+
+        """
+        grams = sorted(
+            trigrams(query), key=lambda gram: len(self._postings.get(gram, ()))
+        )
+        postings = [self._postings.get(gram, ()) for gram in grams]
+        cap = limit * self.FUZZY_CANDIDATES
+        counts = Counter()
+        scanned = rare = 0
+        for keys in postings:
+            if counts and scanned + len(keys) > self.FUZZY_BUDGET:
+                break
+            counts.update(keys)
+            scanned += len(keys)
+            rare += 1
+        best = max(counts.values(), default=0)
+        candidates = {key for key, count in counts.items() if count * 2 >= best}
+        if len(candidates) > cap:
+            candidates = {key for key, _ in counts.most_common(cap)}
+        common = None
+        for keys in postings[rare:]:
+            narrowed = keys if common is None else common & keys
+            if narrowed:
+                common = narrowed
+            if len(common) <= cap:
+                candidates.update(common)
+                break
+        # The rare postings are already counted for every candidate
+        shared = Counter({key: counts[key] for key in candidates})
+        for keys in postings[rare:]:
+            shared.update(candidates.intersection(keys))
+        scores = {}
+        for key, count in shared.items():
+            similarity = count / (len(grams) + self._grams[key] - count)
+            if similarity >= self.min_similarity:
+                scores[key] = similarity
+        return scores
+
+    def best_matches(self, query: str, limit: int = 10) -> List[Hashable]:
+        """Returns the keys of the best group of matches.
+
+        If there are exact matches, only they are returned. Otherwise only
+        prefix matches, then only word prefix matches. Fuzzy matches are
+        returned only if nothing else is found. This way a unique partial name
+        resolves to exactly one key.
+
+        Args:
+            query (str): Full or partial item name.
+            limit (int): The maximum number of results. Defaults to 10.
+
+        Returns:
+            list: Keys, best matches first.
+
+        """
+        ranked = self.search(query, limit)
+        if ranked and ranked[0][1] >= self.WORD_PREFIX:
+            best = ranked[0][1]
+            return [key for key, score in ranked if score == best]
+        return [key for key, score in ranked]
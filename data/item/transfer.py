@@ -0,0 +1,297 @@
+import csv
+import json
+import time
+from typing import Iterator, TextIO, Tuple, Union
+
+from mongoengine import ValidationError
+from pymongo.errors import BulkWriteError
+
+from .item import Item, Weapon, Armor, item_ids
+
+ITEM_CLASSES = {"item": Item, "weapon": Weapon, "armor": Armor}
+FORMATS = ("jsonl", "csv")
+
+
+def item_fields(cls: type) -> list:
+    """Returns the names of the stored fields of the item class.
+
+    Args:
+        cls (type): Item class.
+
+    Returns:
+        list: Field names.
+
+    """
+    return [name for name in cls._fields_ordered if name not in ("id", "_cls")]
+
+
+CSV_FIELDS = ["type"] + list(
+    dict.fromkeys(name for cls in ITEM_CLASSES.values() for name in item_fields(cls))
+)
+
+
+class TransferReport:
+    """Result of an item import or export.
+
+    Attributes:
+        rows (int): Number of processed rows.
+        written (int): Number of written items or rows.
+        errors (list): Pairs of the row number and the error text.
+        elapsed (float): Time spent in seconds.
+
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.written = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Returns the number of processed rows per second."""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.written}/{self.rows} rows in {self.elapsed:.2f} s "
+            f"({self.rate:.0f} rows/s), {len(self.errors)} errors"
+        )
+
+
+def read_raw_rows(
+    stream: TextIO, fmt: str
+) -> Iterator[Tuple[int, Union[str, dict, csv.Error]]]:
+    """Reads item rows one by one without decoding them.
+
+    A malformed row does not stop the reading, it is decoded and reported
+    separately, see `decode_row`.
+
+    Args:
+        stream (TextIO): Text stream to read.
+        fmt (str): Stream format. May be jsonl or csv.
+
+    Yields:
+        Tuple[int, Union[str, dict, csv.Error]]: Line number and the row: a
+            JSON line, a CSV row or the error of a malformed CSV row. Blank
+            lines and the CSV header are counted in line numbers.
+
+    """
+    if fmt == "jsonl":
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                yield number, line
+    elif fmt == "csv":
+        reader = csv.DictReader(stream)
+        rows = iter(reader)
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield reader.line_num, e
+                continue
+            yield reader.line_num, {
+                key: value for key, value in row.items() if value not in ("", None)
+            }
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def decode_row(raw: Union[str, dict, csv.Error]) -> dict:
+    """Decodes a row read by `read_raw_rows`.
+
+    Args:
+        raw (Union[str, dict, csv.Error]): Raw row.
+
+    Returns:
+        dict: Item row.
+
+    Raises:
+        ValueError: If the row is malformed.
+
+    """
+    if isinstance(raw, csv.Error):
+        raise ValueError(f"Malformed CSV row: {raw}")
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Malformed JSON: {e}")
+        if not isinstance(raw, dict):
+            raise ValueError("Row is not a JSON object")
+    return raw
+
+
+def read_rows(stream: TextIO, fmt: str) -> Iterator[dict]:
+    """Reads item rows one by one.
+
+    Args:
+        stream (TextIO): Text stream to read.
+        fmt (str): Stream format. May be jsonl or csv.
+
+    Yields:
+        dict: Item row.
+
+    Raises:
+        ValueError: If a row is malformed.
+
+    """
+    for _, raw in read_raw_rows(stream, fmt):
+        yield decode_row(raw)
+
+
+def build_item(row: dict, item_id: int) -> Item:
+    """Creates and validates an item from the row.
+
+    Args:
+        row (dict): Item row. The `type` key selects the item class and
+            defaults to item. The `item_id` key is ignored.
+        item_id (int): ID of the new item.
+
+    Returns:
+        Item: Validated item which is not saved yet.
+
+    Raises:
+        ValidationError: If the row does not match the item fields.
+
+    """
+    row = dict(row)
+    item_type = str(row.pop("type", "item")).lower()
+    try:
+        cls = ITEM_CLASSES[item_type]
+    except KeyError:
+        raise ValidationError(f"Unknown item type: {item_type}")
+    row.pop("item_id", None)
+    values = {}
+    for name, value in row.items():
+        field = cls._fields.get(name) if name in item_fields(cls) else None
+        if field is None:
+            raise ValidationError(f"Unknown field for {item_type}: {name}")
+        values[name] = field.to_python(value)
+    item = cls(item_id=item_id, **values)
+    item.validate()
+    return item
+
+
+def import_items(
+    stream: TextIO, fmt: str, chunk_size: int = 500
+) -> TransferReport:
+    """Imports items from a stream.
+
+    Rows are validated against the `Item`, `Weapon` and `Armor` fields, get
+    IDs from blocks reserved in `item_ids` and are inserted with
+    `insert_many` in chunks. Malformed and invalid rows, as well as rows
+    rejected by the database, are skipped and reported with their line
+    numbers.
+
+    Args:
+        stream (TextIO): Text stream to read.
+        fmt (str): Stream format. May be jsonl or csv.
+        chunk_size (int): Number of items inserted at once. Defaults to 500.
+
+    Returns:
+        TransferReport: Import report.
+
+    """
+    report = TransferReport()
+    started = time.perf_counter()
+    collection = Item._get_collection()
+    chunk = []
+    numbers = []
+    ids = iter(())
+
+    def flush():
+        if not chunk:
+            return
+        try:
+            collection.insert_many(chunk, ordered=False)
+            report.written += len(chunk)
+        except BulkWriteError as e:
+            report.written += e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", []):
+                report.errors.append((numbers[error["index"]], error["errmsg"]))
+        chunk.clear()
+        numbers.clear()
+
+    for number, raw in read_raw_rows(stream, fmt):
+        report.rows += 1
+        try:
+            row = decode_row(raw)
+        except ValueError as e:
+            report.errors.append((number, str(e)))
+            continue
+        item_id = next(ids, None)
+        if item_id is None:
+            ids = iter(item_ids.reserve(chunk_size))
+            item_id = next(ids)
+        try:
+            item = build_item(row, item_id)
+        except (ValidationError, ValueError, TypeError) as e:
+            report.errors.append((number, str(e)))
+            continue
+        chunk.append(item.to_mongo())
+        numbers.append(number)
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    report.errors.sort(key=lambda error: error[0])
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def item_row(item: Item) -> dict:
+    """Returns the row of the item for export.
+
+    Args:
+        item (Item): Item to export.
+
+    Returns:
+        dict: Item row.
+
+    """
+    row = {"type": item.category.lower()}
+    for name in item_fields(type(item)):
+        value = getattr(item, name)
+        if value is not None:
+            row[name] = value
+    return row
+
+
+def export_items(
+    stream: TextIO, fmt: str, batch_size: int = 500
+) -> TransferReport:
+    """Exports all items to a stream.
+
+    Items are read from the database in batches and written one by one, so
+    the whole catalog is never held in memory.
+
+    Args:
+        stream (TextIO): Text stream to write.
+        fmt (str): Stream format. May be jsonl or csv.
+        batch_size (int): Number of items read from the database at once.
+            Defaults to 500.
+
+    Returns:
+        TransferReport: Export report.
+
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    report = TransferReport()
+    started = time.perf_counter()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(stream, CSV_FIELDS)
+        writer.writeheader()
+    for item in Item.objects.order_by("_id").batch_size(batch_size):
+        report.rows += 1
+        row = item_row(item)
+        if writer:
+            writer.writerow(row)
+        else:
+            stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+        report.written += 1
+    report.elapsed = time.perf_counter() - started
+    return report
@@ -0,0 +1,304 @@
+import bisect
+import contextvars
+import time
+from typing import Callable, Dict, Sequence
+
+from pymongo import monitoring
+
+_current = contextvars.ContextVar("rpg_command_trace", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class CommandTrace:
+    """Database and Discord work done within a context.
+
+    Tracing starts with `CommandTrace.start` or on entering the `with` block.
+    Blocking calls made through `Repository.run` inherit the context of the
+    caller, so their queries are counted too.
+
+    Attributes:
+        queries (int): Number of sent database commands.
+        db_time (float): Time spent in database calls run through
+            `Repository.run`, in seconds.
+        discord_time (float): Time spent awaiting Discord API requests, in
+            seconds. See `instrument_http`.
+        started (float): `time.perf_counter` value when the trace was started.
+
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.discord_time = 0.0
+        self.started = None
+        self._token = None
+
+    @staticmethod
+    def current():
+        """Returns the active trace of the current context, if it exists."""
+        return _current.get()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def start(self):
+        """Starts tracing in the current context."""
+        self.started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def stop(self):
+        """Stops tracing in the current context."""
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class QueryCounter(monitoring.CommandListener):
+    """Command listener that feeds the active `CommandTrace`.
+
+    The listener must be passed to the client in `event_listeners`.
+
+    """
+
+    def started(self, event):
+        trace = _current.get()
+        if trace is not None:
+            trace.queries += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def instrument_http(http) -> Callable[[], None]:
+    """Adds the time of Discord API requests to the active trace.
+
+    Every request of the bot, including sent and edited messages and
+    reactions, goes through `HTTPClient.request`, which is wrapped.
+
+    Args:
+        http (discord.http.HTTPClient): HTTP client of the bot.
+
+    Returns:
+        Callable[[], None]: Function that removes the wrapper.
+
+    """
+    request = http.request
+    own = "request" in vars(http)
+
+    async def traced_request(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return await request(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await request(*args, **kwargs)
+        finally:
+            trace.discord_time += time.perf_counter() - started
+
+    def restore():
+        if vars(http).get("request") is traced_request:
+            if own:
+                http.request = request
+            else:
+                del http.request
+
+    http.request = traced_request
+    return restore
+
+
+class Histogram:
+    """Histogram with fixed bucket bounds.
+
+    Attributes:
+        bounds (Sequence[float]): Upper bounds of the buckets. The last bucket
+            has no bound.
+        counts (list): Number of observations by bucket, not cumulative.
+        count (int): Number of observations.
+        sum (float): Sum of the observed values.
+        max (float): The largest observed value.
+
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram"):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Estimates the quantile by linear interpolation within its bucket.
+
+        Args:
+            q (float): Quantile between 0 and 1.
+
+        Returns:
+            float: Estimated value. Values of the last bucket are estimated
+                with the largest observed value.
+
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class RollingHistogram:
+    """Histogram of the recent observations, plus the lifetime totals.
+
+    The window is split into slots that are reused as time goes on, so
+    observing takes constant time and old observations drop out slot by
+    slot.
+
+    Attributes:
+        total (Histogram): All observations.
+
+    """
+
+    __slots__ = ("bounds", "total", "_slot_length", "_slots")
+
+    def __init__(self, bounds: Sequence[float], window: float = 600, slots: int = 10):
+        self.bounds = bounds
+        self.total = Histogram(bounds)
+        self._slot_length = window / slots
+        self._slots = [(None, Histogram(bounds)) for _ in range(slots)]
+
+    def observe(self, value: float, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        number = int(now // self._slot_length)
+        index = number % len(self._slots)
+        stamp, histogram = self._slots[index]
+        if stamp != number:
+            histogram = Histogram(self.bounds)
+            self._slots[index] = (number, histogram)
+        histogram.observe(value)
+        self.total.observe(value)
+
+    def window(self, now: float = None) -> Histogram:
+        """Returns the histogram of the observations within the window."""
+        if now is None:
+            now = time.monotonic()
+        oldest = int(now // self._slot_length) - len(self._slots) + 1
+        result = Histogram(self.bounds)
+        for stamp, histogram in self._slots:
+            if stamp is not None and stamp >= oldest:
+                result.merge(histogram)
+        return result
+
+
+class CommandStats:
+    """Rolling per-command histograms of traced commands.
+
+    Attributes:
+        window (float): Length of the rolling window in seconds.
+        commands (Dict[str, Dict[str, RollingHistogram]]): Histograms by
+            command and metric: wall, db, discord and queries.
+
+    """
+
+    METRICS = {
+        "wall": ("rpg_command_duration_seconds", "Command wall time."),
+        "db": ("rpg_command_db_seconds", "Time spent in database calls."),
+        "discord": ("rpg_command_discord_seconds", "Time spent in Discord requests."),
+        "queries": ("rpg_command_queries", "Database commands sent by a command."),
+    }
+
+    def __init__(self, window: float = 600):
+        self.window = window
+        self.commands: Dict[str, Dict[str, RollingHistogram]] = {}
+
+    def observe(self, command: str, trace: CommandTrace, wall: float):
+        """Records the trace of a finished command.
+
+        Args:
+            command (str): Qualified command name.
+            trace (CommandTrace): The trace of the command.
+            wall (float): Wall time of the command in seconds.
+        """
+        histograms = self.commands.get(command)
+        if histograms is None:
+            histograms = {
+                metric: RollingHistogram(
+                    QUERY_BUCKETS if metric == "queries" else LATENCY_BUCKETS,
+                    self.window,
+                )
+                for metric in self.METRICS
+            }
+            self.commands[command] = histograms
+        now = time.monotonic()
+        histograms["wall"].observe(wall, now)
+        histograms["db"].observe(trace.db_time, now)
+        histograms["discord"].observe(trace.discord_time, now)
+        histograms["queries"].observe(trace.queries, now)
+
+    def prometheus(self) -> str:
+        """Returns the lifetime histograms in the Prometheus text format.
+
+        Returns:
+            str: Exposition text.
+
+        """
+        lines = []
+        for metric, (name, description) in self.METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for command, histograms in sorted(self.commands.items()):
+                histogram = histograms[metric].total
+                label = (
+                    command.replace("\\", "\\\\")
+                    .replace('"', '\\"')
+                    .replace("\n", "\\n")
+                )
+                cumulative = 0
+                for bound, count in zip(
+                    list(histogram.bounds) + ["+Inf"], histogram.counts
+                ):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{command="{label}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{name}_sum{{command="{label}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{command="{label}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
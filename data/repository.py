@@ -0,0 +1,586 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+import weakref
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, List, Optional, TextIO
+
+from .cache import LRUCache
+from .character.character import Character
+from .item.catalog import ItemCatalog
+from .item.item import Item
+from .item.transfer import TransferReport, import_items, export_items
+from .monitoring import CommandTrace
+
+log = logging.getLogger("red.rpg")
+
+
+class Repository:
+    """Base class of the asynchronous database access layer.
+
+    Mongoengine is synchronous, so every database call is run in a bounded
+    thread pool instead of the event loop. Calls inherit the context of the
+    caller, so their queries and time are added to the active `CommandTrace`.
+
+    Attributes:
+        loop (asyncio.AbstractEventLoop): Event loop of the bot.
+        executor (Executor): The thread pool that performs database calls.
+        revision (int): Number of changes made through the repository.
+
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, executor: Executor):
+        self.loop = loop
+        self.executor = executor
+        self.revision = 0
+        self._versions = {}
+
+    def version(self, key) -> int:
+        """Returns the version of the document.
+
+        The version changes every time the document is saved or deleted
+        through the repository, so it can be used to key data derived from
+        the document.
+
+        Args:
+            key: Document ID.
+
+        Returns:
+            int: Document version.
+
+        """
+        return self._versions.get(key, 0)
+
+    def _changed(self, key=None):
+        self.revision += 1
+        if key is not None:
+            self._versions[key] = self.revision
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Runs a blocking function in the executor.
+
+        Args:
+            func (Callable): Function to run.
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            The result of the function.
+
+        """
+        context = contextvars.copy_context()
+        trace = CommandTrace.current()
+        if trace is None:
+            return await self.loop.run_in_executor(
+                self.executor, context.run, functools.partial(func, *args, **kwargs)
+            )
+        started = time.perf_counter()
+        try:
+            return await self.loop.run_in_executor(
+                self.executor, context.run, functools.partial(func, *args, **kwargs)
+            )
+        finally:
+            trace.db_time += time.perf_counter() - started
+
+
+class CharacterRepository(Repository):
+    """Asynchronous access to characters.
+
+    Loaded characters are kept in a cache keyed by member ID, so the cog must
+    save and delete characters only through this class.
+
+    With a positive `flush_interval` saves are write-behind: a saved
+    character is marked dirty and written later together with the other
+    dirty characters in a single request. Saving the same character again
+    before the flush only adds its updates to the same batch. Dirty
+    characters are returned by `get` even if the cache has evicted them.
+    Characters of a failed flush stay dirty and are written with the next
+    one, up to `flush_retries` times.
+
+    A cached character is shared by all commands, and its changes run in
+    the executor. Commands change and save a character while holding the
+    lock of the member, see `lock`. Flushes hold the locks of the characters
+    they write.
+
+    Attributes:
+        document (type): Character document class.
+        cache (LRUCache): Cache of loaded characters.
+        flush_interval (float): The longest time a save is delayed, in
+            seconds. Saves are written immediately if it is 0.
+        flush_size (int): Number of dirty characters that triggers a flush
+            before the interval ends.
+        flush_retries (int): Number of failed flushes after which the
+            changes of a character are dropped.
+        flushes (int): Number of flushes.
+        flushed (int): Number of characters written by the flushes.
+
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        executor: Executor,
+        document: type = Character,
+        cache: LRUCache = None,
+        flush_interval: float = 0,
+        flush_size: int = 500,
+        flush_retries: int = 3,
+    ):
+        super().__init__(loop, executor)
+        self.document = document
+        self.cache = cache if cache is not None else LRUCache()
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.flush_retries = flush_retries
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        self._dirty: Dict[str, Character] = {}
+        self._superseded: List[Character] = []
+        self._attempts: Dict[str, int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer = None
+        self._locks = weakref.WeakValueDictionary()
+
+    @property
+    def pending(self) -> int:
+        """Number of characters waiting to be written."""
+        return len(self._dirty) + len(self._superseded)
+
+    @property
+    def write_stats(self) -> dict:
+        """Returns write-behind counters.
+
+        Returns:
+            dict: Pending characters, flushes, written characters and
+                characters whose changes were dropped.
+
+        """
+        return {
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failed": self.failed,
+        }
+
+    def lock(self, member_id: str) -> asyncio.Lock:
+        """Returns the lock of the member's character.
+
+        The lock exists while it is used, so idle members hold no locks.
+
+        Args:
+            member_id (str): Member ID.
+
+        Returns:
+            asyncio.Lock: Character lock.
+
+        """
+        lock = self._locks.get(member_id)
+        if lock is None:
+            lock = self._locks[member_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def lock_all(self, member_ids: Iterable[str]):
+        """Holds the locks of several characters.
+
+        The locks are taken in the order of member IDs, so two callers never
+        wait for each other.
+
+        Args:
+            member_ids (Iterable[str]): Member IDs.
+        """
+        locks = [self.lock(member_id) for member_id in sorted(set(member_ids))]
+        taken = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                taken.append(lock)
+            yield
+        finally:
+            for lock in reversed(taken):
+                lock.release()
+
+    async def get(self, member_id: str) -> Character:
+        """Returns character object.
+
+        Args:
+            member_id (str): Member ID to get.
+
+        Returns:
+            Character: Character object.
+
+        Raises:
+            CharacterNotFound: If the member is not registered.
+
+        """
+        char = self._dirty.get(member_id)
+        if char is None:
+            char = self.cache.get(member_id)
+        if char is None:
+            char = await self.run(self.document.get_char_by_id, member_id)
+            self.cache.set(member_id, char)
+        return char
+
+    async def exists(self, member_id: str) -> bool:
+        """Returns whether the member has a character.
+
+        Args:
+            member_id (str): Member ID to check.
+
+        Returns:
+            bool: Character registered or not.
+
+        """
+        if member_id in self._dirty or member_id in self.cache:
+            return True
+        return await self.run(self.document.is_member_registered, member_id)
+
+    async def save(self, char: Character):
+        """Saves the character.
+
+        Inventory and equipment changes are written with the atomic updates
+        recorded by the character, see `Character.save_updates`. In the
+        write-behind mode the character is only marked dirty.
+
+        Args:
+            char (Character): Character to save.
+        """
+        if self.flush_interval:
+            self._mark_dirty([char])
+            return
+        try:
+            await self.run(char.save_updates)
+        except Exception:
+            self.cache.pop(char.member_id)
+            self._changed(char.member_id)
+            raise
+        self.cache.set(char.member_id, char)
+        self._changed(char.member_id)
+
+    async def save_all(self, chars: List[Character]):
+        """Saves several characters with a single request where possible.
+
+        Args:
+            chars (List[Character]): Characters to save.
+        """
+        if self.flush_interval:
+            self._mark_dirty(chars)
+            return
+        try:
+            await self.run(self.document.save_all, chars)
+        except Exception:
+            for char in chars:
+                self.cache.pop(char.member_id)
+                self._changed(char.member_id)
+            raise
+        for char in chars:
+            self.cache.set(char.member_id, char)
+            self._changed(char.member_id)
+
+    def _mark_dirty(self, chars: List[Character]):
+        for char in chars:
+            dirty = self._dirty.get(char.member_id)
+            if dirty is not None and dirty is not char:
+                # Another object of the same character still has to be written
+                self._superseded.append(dirty)
+            self._dirty[char.member_id] = char
+            self.cache.set(char.member_id, char)
+            self._changed(char.member_id)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.pending >= self.flush_size:
+            self._cancel_timer()
+            self.loop.create_task(self._flush_logged())
+        else:
+            self._start_timer()
+
+    def _start_timer(self):
+        if self._flush_timer is None:
+            self._flush_timer = self.loop.call_later(
+                self.flush_interval,
+                lambda: self.loop.create_task(self._flush_logged()),
+            )
+
+    def _cancel_timer(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _take_dirty(self) -> List[Character]:
+        self._cancel_timer()
+        chars = self._superseded + list(self._dirty.values())
+        self._dirty = {}
+        self._superseded = []
+        return chars
+
+    def _requeue(self, chars: List[Character]):
+        superseded = []
+        for char in chars:
+            member_id = char.member_id
+            attempts = self._attempts.get(member_id, 0) + 1
+            if attempts > self.flush_retries:
+                self._attempts.pop(member_id, None)
+                self.failed += 1
+                log.error(
+                    "Changes of character %s dropped after %d failed flushes",
+                    member_id,
+                    attempts,
+                )
+                if self._dirty.get(member_id) is None:
+                    self.cache.pop(member_id)
+                    self._changed(member_id)
+                continue
+            self._attempts[member_id] = attempts
+            dirty = self._dirty.get(member_id)
+            if dirty is None:
+                self._dirty[member_id] = char
+            elif dirty is not char:
+                superseded.append(char)
+        # The failed changes are older than the ones made during the flush
+        self._superseded = superseded + self._superseded
+        if self.pending:
+            self._start_timer()
+
+    async def flush(self):
+        """Writes the dirty characters with a single request.
+
+        Flushes never overlap, so the saves of a character are written in
+        order. If the flush fails, the characters stay dirty.
+        """
+        async with self._flush_lock:
+            chars = self._take_dirty()
+            if not chars:
+                return
+            self.flushes += 1
+            try:
+                async with self.lock_all(char.member_id for char in chars):
+                    await self.run(self.document.save_all, chars)
+            except Exception:
+                self._requeue(chars)
+                raise
+            self.flushed += len(chars)
+            for char in chars:
+                self._attempts.pop(char.member_id, None)
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("Failed to write the dirty characters")
+
+    def flush_sync(self):
+        """Writes the dirty characters without the executor.
+
+        Blocks the caller. Used when the cog is unloaded and the loop may no
+        longer run the flush.
+        """
+        chars = self._take_dirty()
+        if chars:
+            self.flushes += 1
+            self.document.save_all(chars)
+            self.flushed += len(chars)
+
+    async def delete(self, member_id: str):
+        """Deletes the character of the member.
+
+        Args:
+            member_id (str): Member ID.
+        """
+        self.cache.pop(member_id)
+        self._forget(member_id)
+        self._changed(member_id)
+        async with self._flush_lock:
+            # A failed flush may have put the character back
+            self._forget(member_id)
+            await self.run(self.document.objects(member_id=member_id).delete)
+
+    def _forget(self, member_id: str):
+        self._dirty.pop(member_id, None)
+        self._attempts.pop(member_id, None)
+        self._superseded = [
+            char for char in self._superseded if char.member_id != member_id
+        ]
+
+
+class ItemRepository(Repository):
+    """Asynchronous access to items.
+
+    Lookups are served from the in-memory catalog once it is loaded. Until
+    then they fall back to the database.
+
+    Attributes:
+        document (type): Item document class.
+        catalog (ItemCatalog): Catalog of all items.
+
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        executor: Executor,
+        document: type = Item,
+        catalog: ItemCatalog = None,
+    ):
+        super().__init__(loop, executor)
+        self.document = document
+        self.catalog = catalog if catalog is not None else ItemCatalog(document)
+
+    async def load(self):
+        """Loads the item catalog."""
+        await self.run(self.catalog.load)
+
+    async def get_by_name(self, name: str) -> List[Item]:
+        """Returns a list of items with the given name.
+
+        Args:
+            name (str): Item name.
+
+        Returns:
+            list: List of items.
+
+        """
+        if self.catalog.loaded:
+            return self.catalog.get_by_name(name)
+        return await self.run(lambda: list(self.document.get_items(name=name)))
+
+    async def search(self, query: str, limit: int = 10) -> List[Item]:
+        """Returns the items with the best matching names.
+
+        Args:
+            query (str): Full or partial item name.
+            limit (int): The maximum number of items. Defaults to 10.
+
+        Returns:
+            list: List of items, best matches first. Empty until the catalog is
+                loaded.
+
+        """
+        if not self.catalog.loaded:
+            return []
+        return self.catalog.search(query, limit)
+
+    async def get_by_id(self, item_id: int) -> Item:
+        """Returns the item by the given id.
+
+        Args:
+            item_id (int): Item ID.
+
+        Returns:
+            Item: Item object.
+
+        Raises:
+            ItemNotFound: If the item is not found.
+
+        """
+        if self.catalog.loaded:
+            return self.catalog.get_by_id(item_id)
+        return await self.run(self.document.get_item_by_id, item_id)
+
+    async def resolve(self, item_ids: Iterable[int]) -> Dict[int, Item]:
+        """Returns the items with the given IDs.
+
+        Items are taken from the catalog. The missing ones are fetched with a
+        single query, so resolving the items of a whole inventory never costs
+        more than one round trip.
+
+        Args:
+            item_ids (Iterable[int]): Item IDs.
+
+        Returns:
+            dict: Items by ID. IDs of nonexistent items are skipped.
+
+        """
+        item_ids = set(item_ids)
+        items = self.catalog.get_many(item_ids) if self.catalog.loaded else {}
+        missing = list(item_ids.difference(items))
+        if missing:
+            items.update(
+                await self.run(
+                    lambda: {
+                        item.item_id: item
+                        for item in self.document.objects(item_id__in=missing)
+                    }
+                )
+            )
+        return items
+
+    async def lookup(self, item_ids: Iterable[int]) -> Callable[[int], Optional[Item]]:
+        """Returns a function that finds items by ID without a query.
+
+        Once the catalog is loaded, the function reads it, so the caller keeps
+        no items of its own. Until then the given items are resolved at once.
+
+        Args:
+            item_ids (Iterable[int]): IDs of the items that will be looked up.
+
+        Returns:
+            Callable[[int], Optional[Item]]: Returns the item by ID, or None if
+                it is not found.
+
+        """
+        if self.catalog.loaded:
+            return self.catalog.get
+        return (await self.resolve(item_ids)).get
+
+    async def next_id(self) -> int:
+        """Returns the next free id.
+
+        Returns:
+            int: Next free id.
+
+        """
+        return await self.run(self.document.get_next_id)
+
+    async def save(self, item: Item):
+        """Saves the item.
+
+        Args:
+            item (Item): Item to save.
+        """
+        await self.run(item.save)
+        self.catalog.add(item)
+        self._changed(item.item_id)
+
+    async def import_items(
+        self, stream: TextIO, fmt: str, chunk_size: int = 500
+    ) -> TransferReport:
+        """Imports items from a stream and reloads the catalog.
+
+        Args:
+            stream (TextIO): Text stream to read.
+            fmt (str): Stream format. May be jsonl or csv.
+            chunk_size (int): Number of items inserted at once. Defaults to 500.
+
+        Returns:
+            TransferReport: Import report.
+
+        """
+        try:
+            report = await self.run(import_items, stream, fmt, chunk_size)
+        except Exception:
+            # Chunks inserted before the error must reach the catalog
+            await self.load()
+            self._changed()
+            raise
+        if report.written:
+            await self.load()
+            self._changed()
+        return report
+
+    async def export_items(self, stream: TextIO, fmt: str) -> TransferReport:
+        """Exports all items to a stream.
+
+        Args:
+            stream (TextIO): Text stream to write.
+            fmt (str): Stream format. May be jsonl or csv.
+
+        Returns:
+            TransferReport: Export report.
+
+        """
+        return await self.run(export_items, stream, fmt)
@@ -1,55 +1,235 @@
-from typing import Union
+import random
+from typing import Tuple, Union
 
 import discord
 from discord.ext import commands
 
 from ...config import config
 from ..character.character import Character
+from ..fight.combat import (
+    ATTACK,
+    POWER_ATTACK,
+    BLOCK,
+    SPELL,
+    HEAL,
+    MAX_ROUNDS,
+    Fighter,
+    resolve_round,
+    winner,
+)
+
+ACTIONS = {"⚔": ATTACK, "💥": POWER_ATTACK, "🛡": BLOCK, "🔥": SPELL, "❤": HEAL}
+ACTION_NAMES = {
+    ATTACK: "атака",
+    POWER_ATTACK: "силовая атака",
+    BLOCK: "блок",
+    SPELL: "огненный шар",
+    HEAL: "исцеление",
+}
+SURRENDER = "🏳"
+ACCEPT = ("✅", "❌")
+CONTROLS = tuple(ACTIONS) + (SURRENDER,)
+LOG_SIZE = 5
+
+CHALLENGE = "challenge"
+FIGHT = "fight"
+FINISHED = "finished"
 
 
 class FightSession:
+    """Duel between two characters.
+
+    The session is a state machine driven by `FightScheduler`: it never
+    waits for anything itself, the scheduler passes reactions and turn
+    timeouts to it and edits the message after each change.
+
+    The fight is calculated on `Fighter` objects, the characters are not
+    changed until the fight ends. The cog then saves the result, see
+    `RPG.on_fight_end`.
+
+    Attributes:
+        ctx (commands.Context): Context object from which this session was
+            started. This object assumes the session was started by `ctx.author`.
+        initiator (Union[discord.Member, discord.User]): The member who started
+            the duel.
+        initiator_char (Character): Initiator's character.
+        opponent (Union[discord.Member, discord.User]): The challenged member.
+        opponent_char (Character): Opponent's character.
+        fighters (Tuple[Fighter, Fighter]): Fighters of the initiator and the
+            opponent.
+        state (str): Challenge, fight or finished.
+        complete (bool): Whether the fight took place. It is False if the
+            opponent declined the duel or the session was stopped.
+        winner (Union[discord.Member, discord.User]): The winner, or None on a
+            draw.
+        rounds (int): Number of played rounds.
+        message (discord.Message): The message object that contains the fight.
+
+    """
+
     def __init__(
         self,
         ctx: commands.Context,
         initiator_char: Character,
         opponent: Union[discord.Member, discord.User],
         opponent_char: Character,
+        fighters: Tuple[Fighter, Fighter],
     ):
         self.ctx = ctx
         self.initiator = ctx.author
         self.initiator_char = initiator_char
         self.opponent = opponent
         self.opponent_char = opponent_char
-        self._task = None
-        self.embed = discord.Embed(
-            title="Бой", colour=discord.Colour(0xC20000)
-        )
-        self.embed.set_author(name=config.bot.name, icon_url=config.bot.icon_url)
-        self.embed.set_footer(text="Создание персонажа")
+        self.fighters = fighters
+        self.state = CHALLENGE
+        self.complete = False
+        self.winner = None
+        self.rounds = 0
         self.message = None
+        self._choices = [None, None]
+        self._log = []
+        self._rng = random.Random()
 
-    @classmethod
-    def start(
-        cls,
-        ctx: commands.Context,
-        initiator_char: Character,
-        opponent: Union[discord.Member, discord.User],
-        opponent_char: Character,
-    ):
-        """Creates and starts fight session.
+    @property
+    def members(self) -> tuple:
+        return self.initiator, self.opponent
+
+    @property
+    def finished(self) -> bool:
+        return self.state == FINISHED
 
-        This allows the session to manage the running and cancellation of its
-        own tasks.
+    def react(self, member: Union[discord.Member, discord.User], emoji: str) -> bool:
+        """Handles a reaction to the fight message.
+
+        During the fight a reaction chooses the action of the member for the
+        current round. It can be changed until the opponent chooses too.
 
         Args:
-            ctx (commands.Context): Same as `FightSession.ctx`
-            initiator_char (Character): Initiator's character
-            opponent (Union[discord.Member, discord.User]): Opponent member object
-            opponent_char (Character): Opponent's character
+            member (Union[discord.Member, discord.User]): The member who reacted.
+            emoji (str): Reaction emoji.
 
         Returns:
-            FightSession: The new fight session being run.
+            bool: Whether the state of the session changed and the message
+                should be updated.
+
+        """
+        member_ids = [m.id for m in self.members]
+        if member.id not in member_ids:
+            return False
+        index = member_ids.index(member.id)
+        if self.state == CHALLENGE:
+            if emoji == ACCEPT[0] and index == 1:
+                self.state = FIGHT
+                return True
+            if emoji == ACCEPT[1]:
+                self._finish(declined=True)
+                return True
+            return False
+        if self.state != FIGHT:
+            return False
+        if emoji == SURRENDER:
+            self._log.append(f"{self.fighters[index].name} сдается.")
+            self.winner = self.members[1 - index]
+            self._finish()
+            return True
+        action = ACTIONS.get(emoji)
+        if action is None:
+            return False
+        self._choices[index] = action
+        if None in self._choices:
+            return False
+        self._play_round()
+        return True
+
+    def timeout(self):
+        """Ends the turn when its time is up.
 
+        An unanswered challenge is declined. A fighter who has not chosen an
+        action attacks.
         """
-        fight = cls(ctx, initiator_char, opponent, opponent_char)
-        return fight
+        if self.state == CHALLENGE:
+            self._finish(declined=True)
+        elif self.state == FIGHT:
+            self._choices = [choice or ATTACK for choice in self._choices]
+            self._play_round()
+
+    def stop(self):
+        """Stops the session without a result."""
+        self.state = FINISHED
+
+    def _play_round(self):
+        first, second = self.fighters
+        result = resolve_round(first, second, tuple(self._choices), self._rng)
+        self._choices = [None, None]
+        self.rounds += 1
+        self._log_round(result)
+        if self.rounds >= MAX_ROUNDS or not (first.alive and second.alive):
+            index = winner(first, second)
+            self.winner = None if index is None else self.members[index]
+            self._finish()
+
+    def _finish(self, declined: bool = False):
+        self.state = FINISHED
+        self.complete = not declined
+
+    def render(self) -> discord.Embed:
+        """Returns the embed that shows the current state of the fight.
+
+        Returns:
+            discord.Embed: Fight embed.
+
+        """
+        embed = discord.Embed(title="Бой", colour=discord.Colour(0xC20000))
+        embed.set_author(name=config.bot.name, icon_url=config.bot.icon_url)
+        embed.set_footer(text="Бой")
+        if self.state == CHALLENGE or (self.finished and not self.complete):
+            if self.finished:
+                embed.description = "Дуэль отменена."
+            else:
+                embed.description = (
+                    f"{self.opponent.mention}, {self.initiator_char.name} вызывает "
+                    f"{self.opponent_char.name} на дуэль!"
+                )
+            return embed
+        for fighter in self.fighters:
+            embed.add_field(
+                name=fighter.name,
+                value=(
+                    f"Здоровье: {int(fighter.health)}/{int(fighter.health_max)}\n"
+                    f"Запас сил: {int(fighter.stamina)}/{int(fighter.stamina_max)}\n"
+                    f"Магия: {int(fighter.magicka)}/{int(fighter.magicka_max)}"
+                ),
+                inline=True,
+            )
+        if self._log:
+            embed.add_field(
+                name="Ход боя", value="\n".join(self._log[-LOG_SIZE:]), inline=False
+            )
+        if self.finished:
+            if self.winner is None:
+                embed.description = "**Ничья!**"
+            else:
+                name = self.fighters[self.members.index(self.winner)].name
+                embed.description = f"**Победитель: {name}!**"
+        else:
+            embed.description = (
+                f"**Раунд {self.rounds + 1}.** Выберите действие: "
+                + ", ".join(
+                    f"{emoji} {ACTION_NAMES[a]}" for emoji, a in ACTIONS.items()
+                )
+                + f", {SURRENDER} сдаться."
+            )
+        return embed
+
+    def _log_round(self, result):
+        for index, fighter in enumerate(self.fighters):
+            text = (
+                f"{self.rounds}. {fighter.name}: {ACTION_NAMES[result.actions[index]]}"
+            )
+            damage = result.damage[1 - index]
+            if damage:
+                text += f", урон {damage:.0f}"
+            if result.healed[index]:
+                text += f", +{result.healed[index]:.0f} здоровья"
+            self._log.append(text)
+        del self._log[:-LOG_SIZE]
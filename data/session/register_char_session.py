@@ -204,9 +204,7 @@ class RegisterSession:
                 else:
                     await self.cancel(embed, message)
                     return False
-            self.char["race"] = list(_config.races.keys())[
-                list(_config.races.values()).index(race_content)
-            ]
+            self.char["race"] = config.race_by_label[race_content]
             embed.add_field(name="Раса", value=race_content.title(), inline=True)
             await message.edit(embed=embed)
             return True
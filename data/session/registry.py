@@ -0,0 +1,98 @@
+import time
+from typing import Hashable
+
+
+class SessionRegistry:
+    """Registry of running sessions keyed by user ID.
+
+    Lookup and removal take constant time. Sessions whose task has finished
+    without ending the session, or which run longer than `ttl`, are treated
+    as abandoned: they are stopped and removed on lookup or by
+    `SessionRegistry.expire`.
+
+    Attributes:
+        ttl (float): The maximum lifetime of a session in seconds.
+
+    """
+
+    def __init__(self, ttl: float = 1800):
+        self.ttl = ttl
+        self._sessions = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id: Hashable) -> bool:
+        return self.get(user_id) is not None
+
+    def _is_abandoned(self, session, started: float, now: float) -> bool:
+        task = getattr(session, "_task", None)
+        return (task is not None and task.done()) or now - started > self.ttl
+
+    def _drop(self, user_id: Hashable):
+        session, _ = self._sessions.pop(user_id)
+        task = getattr(session, "_task", None)
+        if task is not None and not task.done():
+            session.force_stop()
+
+    def add(self, user_id: Hashable, session):
+        """Adds the session of the user.
+
+        Args:
+            user_id (Hashable): User ID.
+            session: Session object.
+        """
+        self._sessions[user_id] = (session, time.monotonic())
+
+    def get(self, user_id: Hashable):
+        """Returns the running session of the user, if it exists.
+
+        Args:
+            user_id (Hashable): User ID.
+
+        Returns:
+            The session object or None.
+
+        """
+        entry = self._sessions.get(user_id)
+        if entry is None:
+            return None
+        if self._is_abandoned(*entry, time.monotonic()):
+            self._drop(user_id)
+            return None
+        return entry[0]
+
+    def pop(self, user_id: Hashable, session=None):
+        """Removes the session of the user.
+
+        Args:
+            user_id (Hashable): User ID.
+            session (optional): If given, the session is removed only if it is
+                the registered one.
+
+        Returns:
+            The removed session or None.
+
+        """
+        entry = self._sessions.get(user_id)
+        if entry is None or (session is not None and entry[0] is not session):
+            return None
+        del self._sessions[user_id]
+        return entry[0]
+
+    def expire(self) -> int:
+        """Stops and removes all abandoned sessions.
+
+        Returns:
+            int: Number of removed sessions.
+
+        """
+        now = time.monotonic()
+        abandoned = [
+            user_id
+            for user_id, entry in self._sessions.items()
+            if self._is_abandoned(*entry, now)
+        ]
+        for user_id in abandoned:
+            self._drop(user_id)
+        return len(abandoned)
@@ -0,0 +1,173 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from os import path
+from typing import List, Optional
+
+from .monitoring import LATENCY_BUCKETS, Histogram
+
+COG_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+class StallReport:
+    """Stalls of the event loop attributed to one call site.
+
+    Attributes:
+        site (str): The call site: frames of the cog from the outermost to
+            the innermost one.
+        count (int): Number of stalls.
+        total (float): Total duration of the stalls in seconds.
+        max (float): The longest stall in seconds.
+        stack (List[str]): Formatted stack of the longest stall.
+
+    """
+
+    __slots__ = ("site", "count", "total", "max", "stack")
+
+    def __init__(self, site: str):
+        self.site = site
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stack = []
+
+    def add(self, duration: float, stack: List[str]):
+        self.count += 1
+        self.total += duration
+        if duration >= self.max:
+            self.max = duration
+            self.stack = stack
+
+
+def call_site(stack: traceback.StackSummary) -> str:
+    """Returns the call site of the stack.
+
+    Args:
+        stack (traceback.StackSummary): Stack from the outermost frame.
+
+    Returns:
+        str: Frames of the cog joined with " > ", or the innermost frame if
+            the stack has no frames of the cog.
+
+    """
+    frames = [
+        f"{path.splitext(path.basename(frame.filename))[0]}.{frame.name}:{frame.lineno}"
+        for frame in stack
+        if frame.filename.startswith(COG_ROOT)
+        and path.abspath(frame.filename) != path.abspath(__file__)
+    ]
+    if not frames and stack:
+        frame = stack[-1]
+        frames = [f"{frame.filename}:{frame.name}:{frame.lineno}"]
+    return " > ".join(frames)
+
+
+class LoopWatchdog:
+    """Measures the lag of the event loop and catches blocking calls.
+
+    A task on the loop wakes up every `interval` and records how late it
+    was. A thread checks the time of the last wake-up, and when the loop has
+    been blocked longer than `threshold`, it captures the stack of the loop
+    thread with `sys._current_frames`. When the loop wakes up again, the
+    stall is recorded with its duration under the call site of the stack.
+
+    Attributes:
+        threshold (float): The shortest blocking time reported as a stall.
+        interval (float): Interval of the loop wake-ups.
+        lag (Histogram): Lag of the wake-ups in seconds.
+
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        threshold: float = 0.25,
+        interval: float = 0.05,
+    ):
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = Histogram(LATENCY_BUCKETS)
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._reports = {}
+        self._pending = None
+        self._beat = None
+        self._loop_thread = None
+        self._stopped = threading.Event()
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        """Starts the wake-up task and the watchdog thread."""
+        if self._task is not None:
+            return
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="rpg-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the task and the thread."""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._thread = None
+
+    async def _heartbeat(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - self._beat - self.interval)
+            self._beat = now
+            self.lag.observe(lag)
+            with self._lock:
+                pending, self._pending = self._pending, None
+                if pending is not None:
+                    site, stack = pending
+                    report = self._reports.get(site)
+                    if report is None:
+                        report = self._reports[site] = StallReport(site)
+                    report.add(lag + self.interval, stack)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            if beat is None or time.monotonic() - beat < self.threshold:
+                continue
+            with self._lock:
+                if self._pending is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                stack = traceback.extract_stack(frame)
+                self._pending = (call_site(stack), stack.format())
+
+    def reports(self, limit: Optional[int] = None) -> List[StallReport]:
+        """Returns the stall reports sorted by total stall time.
+
+        Args:
+            limit (:obj:`int`, optional): Maximum number of reports.
+
+        Returns:
+            List[StallReport]: Reports by call site.
+
+        """
+        with self._lock:
+            reports = sorted(
+                self._reports.values(), key=lambda report: report.total, reverse=True
+            )
+        return reports[:limit]
+
+    def reset(self):
+        """Clears the reports and the lag histogram."""
+        with self._lock:
+            self._reports.clear()
+            self.lag = Histogram(LATENCY_BUCKETS)